@@ -0,0 +1,127 @@
+"""Generate realistic, large pto.yaml files for benchmarking
+
+Run from the repository root: python -m bench.generate -o large-pto.yaml --years 10 --entries 200
+"""
+import sys
+import json
+import random
+import argparse
+import datetime
+
+import yaml
+
+from lib.dates import HolidayList, HOLIDAYS
+
+
+TYPE_STYLES = [
+    {'name': 'Vacation', 'short': 'Vac', 'accrual_days': [15, -1], 'total': 120, 'rollover': 16},
+    {'name': 'Sick', 'accrual_weeks': 2, 'accrual_amount': 2},
+    {'name': 'Floating', 'short': 'Flt', 'accrued': False, 'total': 16},
+    {'name': 'Personal', 'short': 'Per', 'accrual_days': [-1], 'total': 24},
+    {'name': 'Comp', 'accrual_weeks': 1, 'total': 40},
+]
+
+
+def _working_day(rand, year, holidays):
+    while True:
+        dt = datetime.date(year, 1, 1) + datetime.timedelta(days=rand.randrange(365))
+        if dt.year == year and holidays.is_business_day(dt):
+            return dt
+
+
+def make_entry(rand, year, n, type_keys, holidays):
+    start = _working_day(rand, year, holidays)
+    entry = {
+        'name': f'Entry {n}',
+        'pto_type': rand.choice(type_keys),
+        'start': start.isoformat(),
+    }
+
+    kind = rand.random()
+    if kind < 0.3:
+        entry['hours'] = rand.choice([2, 4, 8])
+    elif kind < 0.5:
+        entry['days'] = rand.choice([0.5, 1, 2])
+    else:
+        # Up to a week, or occasionally a multi-week leave
+        length = rand.randint(14, 35) if kind > 0.9 else rand.randint(0, 6)
+        end = start + datetime.timedelta(days=length)
+        while end.isoweekday() > 5:
+            end += datetime.timedelta(days=1)
+        if end != start:
+            entry['end'] = end.isoformat()
+            entry['start_half'] = rand.random() < 0.1
+            entry['end_half'] = rand.random() < 0.1
+
+    state = rand.random()
+    if state < 0.4:
+        entry['approved'] = True
+    elif state < 0.45:
+        entry['approved'] = False
+    elif state < 0.6:
+        entry['requested'] = True
+    elif state < 0.8:
+        entry['tentative'] = True
+
+    for k in ('travel', 'lodging', 'registration', 'roommates'):
+        if rand.random() < 0.1:
+            entry[k] = rand.random() < 0.5
+    return entry
+
+
+def make_document(years=10, types=3, entries=100, first_year=2015, seed=0):
+    rand = random.Random(seed)
+    us = [h.name for h in HOLIDAYS['US'].holidays]
+    collections = []
+    for year in range(first_year, first_year + years):
+        pto_types = {}
+        for n in range(types):
+            style = dict(TYPE_STYLES[n % len(TYPE_STYLES)])
+            if n >= len(TYPE_STYLES):
+                style['name'] = f"{style['name']} {n}"
+                style.pop('short', None)
+            pto_types[f'type{n}'] = style
+
+        bank_holidays = ['default'] + ['-' + h for h in rand.sample(us, 2)] + [
+            {'name': 'Company Day', 'month': rand.randint(1, 12), 'day_of_week': rand.randint(1, 5), 'occurrence': rand.choice([-1, 1, 2])},
+        ]
+        holidays = rand.sample(us, 6)
+        calendar = HolidayList(holidays=[h for h in HOLIDAYS['US'].holidays if h.name in holidays])
+        collections.append({
+            'name': f'Bench {year}',
+            'year': year,
+            'timezone': 'America/New_York',
+            'working_hours': [9, 17],
+            'bank_holidays': bank_holidays,
+            'holidays': holidays,
+            'pto_types': pto_types,
+            'pto_entries': [make_entry(rand, year, n, list(pto_types.keys()), calendar) for n in range(entries)],
+        })
+    return {'collections': collections}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a large pto.yaml for benchmarking")
+    parser.add_argument('-o', '--output', help="Path to write to, .json writes JSON, stdout if not set")
+    parser.add_argument('--years', type=int, default=10, help="Number of collections (years)")
+    parser.add_argument('--first-year', type=int, default=2015, help="Year of the first collection")
+    parser.add_argument('--types', type=int, default=3, help="Number of PTO types per year")
+    parser.add_argument('--entries', type=int, default=100, help="Number of entries per year")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    doc = make_document(args.years, args.types, args.entries, args.first_year, args.seed)
+    if args.output and args.output.endswith('.json'):
+        text = json.dumps(doc, indent=1)
+    else:
+        text = yaml.dump(doc, sort_keys=False)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    sys.exit(main() or 0)
@@ -0,0 +1,55 @@
+"""Compare parse times of the available pto.yaml loaders on a large generated document
+
+Run from the repository root: python -m bench.parse
+"""
+import sys
+import json
+import time
+import argparse
+
+import yaml
+
+from lib.loader import parse_document
+from bench.generate import make_document
+
+
+def best_of(repeat, func):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pto.yaml parsing")
+    parser.add_argument('--years', type=int, default=10, help="Number of collections to generate")
+    parser.add_argument('--entries', type=int, default=500, help="Number of entries per collection")
+    parser.add_argument('--repeat', type=int, default=3, help="Take the best of this many runs")
+    args = parser.parse_args()
+
+    doc = make_document(years=args.years, entries=args.entries)
+    as_yaml = yaml.dump(doc, sort_keys=False).encode('utf-8')
+    as_json = json.dumps(doc).encode('utf-8')
+    print(f"YAML: {len(as_yaml)} bytes, JSON: {len(as_json)} bytes")
+
+    loaders = [('SafeLoader', lambda: yaml.load(as_yaml, Loader=yaml.SafeLoader))]
+    if hasattr(yaml, 'CSafeLoader'):
+        loaders.append(('CSafeLoader', lambda: yaml.load(as_yaml, Loader=yaml.CSafeLoader)))
+    else:
+        print("libyaml is not available, skipping CSafeLoader")
+    loaders.append(('json', lambda: parse_document(as_json, 'pto.json')))
+
+    baseline = None
+    for name, func in loaders:
+        elapsed, result = best_of(args.repeat, func)
+        if result != doc:
+            print(f"{name}: result differs from the source document", file=sys.stderr)
+            return 1
+        baseline = baseline or elapsed
+        print(f"{name:12} {elapsed * 1000:10.1f} ms  {baseline / elapsed:6.1f}x")
+
+
+if __name__ == '__main__':
+    sys.exit(main() or 0)
@@ -0,0 +1,135 @@
+"""Time each stage of loading and listing a pto.yaml file
+
+Run from the repository root: python -m bench.run [-f large-pto.yaml] [-o results.json] [--compare old.json]
+Without -f, a file is generated with bench.generate.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+from types import SimpleNamespace
+
+import yaml
+
+import main as cli
+from lib import __version__
+from lib.data import PTOType, PTOEntry
+from lib.loader import SourceFile, gil_enabled, raw_collections, validate_collections
+from bench.generate import make_document
+
+
+def timed(repeat, func):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'best': min(times), 'mean': sum(times) / len(times), 'runs': times}
+
+
+def run(path, repeat):
+    stages = {}
+    data = SourceFile(path).data
+    collections = raw_collections(data)
+    years = validate_collections(collections).collections
+
+    stages['parse'] = timed(repeat, lambda: SourceFile(path).data)
+    stages['validate'] = timed(repeat, lambda: validate_collections(collections, jobs=1))
+    stages['validate_threads'] = timed(repeat, lambda: validate_collections(collections, jobs=os.cpu_count()))
+
+    def _types():
+        for raw, year in zip(collections, years):
+            context = year.validation_context()
+            for t in raw.get('pto_types', {}).values():
+                PTOType.model_validate(t, context=context)
+    stages['check_data'] = timed(repeat, _types)
+
+    def _entries():
+        for raw, year in zip(collections, years):
+            context = year.validation_context()
+            for e in raw.get('pto_entries', []):
+                PTOEntry.model_validate(e, context=context)
+    stages['parse_and_check'] = timed(repeat, _entries)
+
+    def _ledger():
+        for year in years:
+            year.invalidate()
+            year.ledger.balances
+    stages['ledger'] = timed(repeat, _ledger)
+
+    def _adjustments():
+        for year in years:
+            year.invalidate()
+            year.adjustments
+    stages['adjustments'] = timed(repeat, _adjustments)
+
+    args = SimpleNamespace(verbose=3, stream=False, page=None)
+
+    def _list_pto():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for year in years:
+                year.invalidate()
+                cli.list_pto(args, year)
+    stages['list_pto'] = timed(repeat, _list_pto)
+
+    return {
+        'meta': {
+            'version': __version__,
+            'python': platform.python_version(),
+            'libyaml': bool(getattr(yaml, '__with_libyaml__', False)),
+            'gil': gil_enabled(),
+            'file': path,
+            'size': os.path.getsize(path),
+            'years': len(years),
+            'entries': sum(len(y.pto_entries) for y in years),
+            'adjustments': sum(len(y.ledger) for y in years),
+            'repeat': repeat,
+        },
+        'stages': stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stages of loading and listing PTO")
+    parser.add_argument('-f', '--file', help="pto.yaml to benchmark, generated if not set")
+    parser.add_argument('--years', type=int, default=10, help="Years to generate")
+    parser.add_argument('--types', type=int, default=3, help="PTO types per year to generate")
+    parser.add_argument('--entries', type=int, default=200, help="Entries per year to generate")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="Runs per stage")
+    parser.add_argument('-o', '--output', help="Write results as JSON to this file")
+    parser.add_argument('-c', '--compare', help="Previous JSON results to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.file
+        if not path:
+            path = os.path.join(tmp, 'pto.yaml')
+            with open(path, 'w') as fp:
+                yaml.dump(make_document(args.years, args.types, args.entries), fp, sort_keys=False)
+        results = run(path, args.repeat)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, 'r') as fp:
+            previous = json.load(fp)['stages']
+
+    meta = results['meta']
+    print(f"{meta['years']} years, {meta['entries']} entries, {meta['adjustments']} adjustments, {meta['size']} bytes")
+    for name, stage in results['stages'].items():
+        line = f"{name:16} {stage['best'] * 1000:10.2f} ms"
+        if name in previous:
+            line += f"  {previous[name]['best'] / stage['best']:6.2f}x vs previous"
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main() or 0)
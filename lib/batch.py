@@ -0,0 +1,52 @@
+import os
+import glob
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict, Any
+
+from .ledger import STATES
+from .loader import SourceFile, load_year
+
+
+EXTENSIONS = ('.yaml', '.yml', '.json')
+
+
+def expand_paths(patterns: List[str]) -> List[str]:
+    """Files matching glob patterns, or found under directories, in a stable order without duplicates"""
+    out = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [
+                p for p in glob.glob(os.path.join(pattern, '**', '*'), recursive=True)
+                if p.endswith(EXTENSIONS) and os.path.isfile(p)
+            ]
+        else:
+            matches = glob.glob(pattern, recursive=True) or [pattern]
+        out += sorted(matches)
+    return list(dict.fromkeys(out))
+
+
+def process_file(path: str, year: int, name_filter: Optional[str] = None, use_cache: bool = True) -> Dict[str, Any]:
+    """Closing balances of one file's year, by type short name and state; errors are returned, not raised"""
+    try:
+        data = load_year(SourceFile(path), year, name_filter, use_cache=use_cache)
+        ledger = data.ledger
+        closing = {}
+        for ti, t in enumerate(ledger.pto_types):
+            closing[t.short_name] = [
+                ledger.balances.at(len(ledger) - 1, ti, si) if len(ledger) else 0.0
+                for si in range(len(STATES))
+            ]
+        return {'path': path, 'name': data.name, 'closing': closing, 'error': None}
+    except Exception as e:
+        return {'path': path, 'name': None, 'closing': {}, 'error': f'{type(e).__name__}: {e}'}
+
+
+def run_batch(paths: List[str], year: int, name_filter: Optional[str] = None, use_cache: bool = True, jobs: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Process many files in parallel, results are in the same order as paths"""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(paths) < 2:
+        return [process_file(p, year, name_filter, use_cache) for p in paths]
+    chunksize = max(1, len(paths) // (4 * jobs))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(process_file, paths, repeat(year), repeat(name_filter), repeat(use_cache), chunksize=chunksize))
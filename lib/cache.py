@@ -0,0 +1,124 @@
+import os
+import time
+import pickle
+import hashlib
+import functools
+from typing import Any, Optional
+
+from . import __version__, profiling
+
+
+MAX_ENTRIES = 10000
+"""Cached values kept when pruning, the least recently used are removed first"""
+
+MAX_AGE = 30 * 24 * 3600
+"""Cached values not used for this many seconds are removed when pruning"""
+
+PRUNE_INTERVAL = 3600
+"""Seconds between prunes of the cache directory, which happen when storing"""
+
+
+def cache_dir() -> str:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache'))
+    return os.path.join(base, 'ptocalc')
+
+
+@functools.cache
+def code_version() -> str:
+    """The tool version plus a fingerprint of the package's modules, so model changes never load stale pickles"""
+    h = hashlib.sha256(__version__.encode('utf-8'))
+    lib_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(lib_dir)):
+        if name.endswith('.py'):
+            st = os.stat(os.path.join(lib_dir, name))
+            h.update(f'{name}:{st.st_size}:{st.st_mtime_ns}'.encode('utf-8'))
+    return h.hexdigest()
+
+
+def cache_path(digest: str, *key) -> str:
+    """Path of the cache entry for a source file's content digest, the tool version and a key"""
+    name = hashlib.sha256(repr((digest, code_version()) + key).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir(), name + '.pickle')
+
+
+@profiling.timed('cache.load')
+def load(digest: str, *key) -> Optional[Any]:
+    """Load a cached value, or None if it is missing or unreadable"""
+    path = cache_path(digest, *key)
+    try:
+        with open(path, 'rb') as fp:
+            value = pickle.load(fp)
+    except Exception:
+        return None
+    # The modification time records the last use, for prune()
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return value
+
+
+@profiling.timed('cache.store')
+def store(value: Any, digest: str, *key):
+    """Cache a value; failures are ignored since the cache is only an optimization"""
+    path = cache_path(digest, *key)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, 'wb') as fp:
+            pickle.dump(value, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return
+    if _prune_due():
+        prune()
+
+
+def _prune_due() -> bool:
+    """Whether PRUNE_INTERVAL has passed since the last prune by any process, claiming the next one if so"""
+    marker = os.path.join(cache_dir(), '.pruned')
+    try:
+        if time.time() - os.stat(marker).st_mtime < PRUNE_INTERVAL:
+            return False
+    except OSError:
+        pass
+    try:
+        with open(marker, 'a'):
+            pass
+        os.utime(marker)
+    except OSError:
+        return False
+    return True
+
+
+@profiling.timed('cache.prune')
+def prune(max_entries: int = MAX_ENTRIES, max_age: float = MAX_AGE):
+    """Remove cached values not used for max_age seconds, then the least recently used beyond max_entries
+
+    Stale entries, such as those of a file's previous contents, are only ever removed this way.
+    """
+    now = time.time()
+    entries = []
+    try:
+        with os.scandir(cache_dir()) as it:
+            for e in it:
+                if e.name.startswith('.'):
+                    continue
+                try:
+                    entries.append((e.stat().st_mtime, e.path))
+                except OSError:
+                    continue
+    except OSError:
+        return
+    entries.sort(reverse=True)
+    for n, (mtime, path) in enumerate(entries):
+        if n >= max_entries or now - mtime > max_age:
+            try:
+                os.unlink(path)
+                profiling.count('cache_pruned')
+            except OSError:
+                pass
@@ -1,10 +1,13 @@
 from typing import Optional, List, Self, Dict, Any, Union, Tuple, Literal
+import datetime
+from functools import cached_property
 
-from pydantic import BaseModel as PydanticBaseModel, field_validator, model_validator, field_serializer, Field
+from pydantic import BaseModel as PydanticBaseModel, field_validator, model_validator, field_serializer, Field, PrivateAttr
 import arrow
 
-from .dates import Holiday, HolidayList, HOLIDAYS
-
+from .dates import Holiday, HolidayList, HOLIDAYS, accrual_schedule, parse_ordinal, resolve_timezone, to_arrow, to_ordinal
+from .ledger import Ledger, PTOAdjustment, STATES
+from . import profiling
 
 
 class BaseModel(PydanticBaseModel):
@@ -34,18 +37,6 @@ class BaseModel(PydanticBaseModel):
     #     return self
 
 
-class PTOAdjustment(BaseModel):
-    class Config:
-        arbitrary_types_allowed = True
-
-    date: arrow.arrow.Arrow
-    pto_type: Optional['PTOType'] = None
-    hours: float
-    # hours_running__confirmed: float = 0.0
-    # hours_running__type: float = 0.0
-    pto: Optional['PTOEntry'] = None
-
-
 class PTOType(BaseModel):
     class Config:
         arbitrary_types_allowed = True
@@ -61,8 +52,11 @@ class PTOType(BaseModel):
     order: int = 0
     """Sort order to use during calculations"""
 
-    rollover: float = 0
-    """Number of hours rolled over from the previous year"""
+    rollover: Union[float, Literal['auto']] = 0.0
+    """Number of hours rolled over from the previous year, or 'auto' to use the previous year's closing planned balance of the same type"""
+
+    rollover_max: Optional[float] = None
+    """If set, an automatic rollover is capped to this many hours"""
 
     accrued: bool = True
     """If true, PTO is accrued over time, otherwise the balance is immediately available and total must be set"""
@@ -80,13 +74,13 @@ class PTOType(BaseModel):
     """Total amount of PTO accrued for the year, if accrued is False this must be set, otherwise it is used to calculate accrual_amount (divided by # of pay periods)"""
 
     @model_validator(mode='after')
+    @profiling.timed('PTOType.check_data')
     def check_data(self, info) -> Self:
-        if self.rollover:
-            self.accruals += [PTOAdjustment.model_validate({
-                'date': arrow.get(info.context['year'], 1, 1, tzinfo=info.context['timezone']),
-                # 'pto_type': self,
-                'hours': self.rollover,
-            }, context=info.context)]
+        year = info.context['year']
+        tzinfo = info.context['tzinfo']
+        jan_1 = datetime.date(year, 1, 1).toordinal()
+        if self.rollover and self.rollover != 'auto':
+            self.accruals += [PTOAdjustment(jan_1, 0, self.rollover, tzinfo, self)]
         if self.accrued:
             if bool(self.accrual_weeks) == bool(self.accrual_days):
                 raise ValueError("If accrued, one of accrual_days or accrual_weeks is required")
@@ -104,42 +98,14 @@ class PTOType(BaseModel):
                 self.total = self.accrual_amount * pay_periods
 
             # Calculate all accrual dates
-            dates = []
-            if self.accrual_weeks:
-                # TODO: this should have an actual start date; may not be 1/1
-                date = arrow.get(info.context['year'], 1, 1, tzinfo=info.context['timezone']).shift(weeks=self.accrual_weeks)
-                while date.year == info.context['year']:
-                    dates.append(date)
-                    date = date.shift(weeks=self.accrual_weeks)
-            else:
-                for month in range(1, 13):
-                    for day in self.accrual_days:
-                        if day == -1:
-                            date = arrow.get(info.context['year'], month, 1, tzinfo=info.context['timezone']) \
-                                .shift(months=1) \
-                                .shift(days=-1)
-                        else:
-                            date = arrow.get(info.context['year'], month, day, tzinfo=info.context['timezone'])
-                        while date.isoweekday() in (6, 7):
-                            date = date.shift(days=-1)
-                        date = info.context['bank_holidays'].find_previous_non_holiday_for_date(date)
-                        dates.append(date)
-            self.accruals += [PTOAdjustment.model_validate({
-                'date': d,
-                # 'pto_type': self,
-                'hours': self.accrual_amount
-            }, context=info.context) for d in dates]
+            dates = accrual_schedule(year, self.accrual_weeks, self.accrual_days, info.context['bank_holidays'])
+            self.accruals += [PTOAdjustment(d, 0, self.accrual_amount, tzinfo, self) for d in dates]
         else:
             if not self.total:
                 raise ValueError("total is required")
 
-            self.accruals += [PTOAdjustment.model_validate({
-                'date': arrow.get(info.context['year'], 1, 1, tzinfo=info.context['timezone']),
-                # 'pto_type': self,
-                'hours': self.total,
-            }, context=info.context)]
-        for a in self.accruals:
-            a.pto_type = self
+            self.accruals += [PTOAdjustment(jan_1, 0, self.total, tzinfo, self)]
+        profiling.count('accruals', len(self.accruals))
 
         return self
 
@@ -197,44 +163,55 @@ class PTOEntry(BaseModel):
     roommates: Optional[bool] = None
     """If none, this entry does not require arranging roommates, otherwise indicates whether roommates has been arranged"""
 
+    start_ordinal: int = Field(default=0, exclude=True, repr=False)
+    """Day of start, as a date ordinal; calculated"""
+
+    start_minute: int = Field(default=0, exclude=True, repr=False)
+    """Time of day of start, in minutes past midnight; calculated"""
+
     @model_validator(mode='after')
+    @profiling.timed('PTOEntry.parse_and_check')
     def parse_and_check(self, info) -> Self:
         if self.pto_type not in info.context['pto_types']:
             raise ValueError("Invalid PTO type")
 
-        self.start = arrow.get(self.start, tzinfo=info.context['timezone']).replace(hour=info.context['working_hours'][0], minute=0, second=0, microsecond=0)
+        tzinfo = info.context['tzinfo']
+        day_start, day_end = info.context['working_hours']
+        full_len = int(day_end - day_start)
+        half_len = int(full_len / 2)
+
+        start_ordinal = parse_ordinal(self.start, tzinfo)
+        start_minute = day_start * 60
         if self.end:
-            self.end = arrow.get(self.end, tzinfo=info.context['timezone']).replace(hour=info.context['working_hours'][1], minute=0, second=0, microsecond=0)
+            end_ordinal = parse_ordinal(self.end, tzinfo)
         else:
-            self.end = self.start.replace(hour=info.context['working_hours'][1])
+            end_ordinal = start_ordinal
+        end_minute = day_end * 60
 
-        full_len = int(info.context['working_hours'][1] - info.context['working_hours'][0])
-        half_len = int(full_len / 2)
         if self.start_half:
-            self.start = self.start.shift(hours=half_len)
+            start_minute += half_len * 60
         if self.end_half:
-            self.end = self.end.shift(hours=-half_len)
+            end_minute -= half_len * 60
 
-        if self.start == self.end:
+        if (start_ordinal, start_minute) == (end_ordinal, end_minute):
             raise ValueError("Start and end times are the same")
 
+        self.start_ordinal, self.start_minute = start_ordinal, start_minute
+        self.start = to_arrow(start_ordinal, start_minute, tzinfo)
+        self.end = to_arrow(end_ordinal, end_minute, tzinfo)
+
         if not (self.days or self.hours):
-            # need to calculate
-            hours = 0
-            date = self.start.replace(hour=0)
-            end = self.end.replace(hour=0).shift(days=1)
-            while date < end:
-                # Weekend or holiday
-                if not (date.isoweekday() in (6, 7) or info.context['holidays'].contains_date(date)):
-                    if (
-                        (date == self.start.replace(hour=0) and self.start_half)
-                        or (date == self.end.replace(hour=0) and self.end_half)
-                    ):
-                        # date is start & start is half, or same for end
-                        hours += half_len
-                    else:
-                        hours += full_len
-                date = date.shift(days=1)
+            # need to calculate; weekends and holidays are not counted
+            holidays = info.context['holidays']
+            start = datetime.date.fromordinal(start_ordinal)
+            end = datetime.date.fromordinal(end_ordinal)
+            hours = holidays.count_business_days(start, end) * full_len
+            if start <= end:
+                # Half days count half_len instead of full_len, the start taking precedence on a single day
+                if self.start_half and holidays.is_business_day(start):
+                    hours -= full_len - half_len
+                if self.end_half and holidays.is_business_day(end) and not (start == end and self.start_half):
+                    hours -= full_len - half_len
             self.hours = hours
 
         if self.days and not self.hours:
@@ -271,7 +248,7 @@ class PTOYear(BaseModel):
     timezone: str
     working_hours: Tuple[int, int]
     bank_holidays: Union[HolidayList, List[Union[Literal['default', 'US'], str, Holiday]]]
-    holidays: Union[HolidayList, List[Union[Holiday, str]]] = []
+    holidays: Union[HolidayList, List[Union[Holiday, str]]] = Field(default=[], validate_default=True)
     pto_types: Dict[str, PTOType] = {}
     pto_entries: List[PTOEntry] = []
 
@@ -316,22 +293,104 @@ class PTOYear(BaseModel):
     def add_context(cls, v, info):
         if info.field_name in ('year', 'timezone', 'working_hours', 'pto_types'):
             info.context[info.field_name] = v
+        if info.field_name == 'timezone':
+            info.context['tzinfo'] = resolve_timezone(v)
         return v
 
+    _ledger: Optional[Ledger] = PrivateAttr(default=None)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == 'timezone':
+            self.__dict__.pop('tzinfo', None)
+        if name in ('pto_types', 'pto_entries', 'timezone'):
+            self.invalidate()
+
+    @cached_property
+    def tzinfo(self) -> datetime.tzinfo:
+        """The resolved timezone, used for all date construction instead of the name"""
+        return resolve_timezone(self.timezone)
+
+    def invalidate(self):
+        """Drop the cached ledger; call after modifying types or entries in place"""
+        self._ledger = None
+
+    @property
+    def needs_rollover(self) -> bool:
+        return any(t.rollover == 'auto' for t in self.pto_types.values())
+
+    def apply_rollover(self, closing: Dict[str, float]):
+        """Resolve rollover: auto types from the previous year's closing balances, by type key"""
+        for key, t in self.pto_types.items():
+            if t.rollover != 'auto':
+                continue
+            hours = closing.get(key, 0.0)
+            if t.rollover_max is not None:
+                hours = min(hours, t.rollover_max)
+            t.rollover = hours
+            if hours:
+                t.accruals.insert(0, PTOAdjustment(datetime.date(self.year, 1, 1).toordinal(), 0, hours, self.tzinfo, t))
+        self.invalidate()
+
+    def add_entries(self, entries: List[Dict[str, Any]]) -> List[PTOEntry]:
+        """Validate raw entries and add them after the existing ones, updating the ledger rather than rebuilding it"""
+        context = self.validation_context()
+        added = [PTOEntry.model_validate(e, context=context) for e in entries]
+        self.pto_entries.extend(added)
+        if self._ledger is not None:
+            self._ledger.add_entries(added)
+        return added
+
+    def add_entry(self, entry: Dict[str, Any]) -> PTOEntry:
+        return self.add_entries([entry])[0]
+
+    def edit_entry(self, index: int, entry: Dict[str, Any]) -> PTOEntry:
+        """Replace the entry at index by a raw entry, updating the ledger from the earlier of the two dates on"""
+        new = PTOEntry.model_validate(entry, context=self.validation_context())
+        self.pto_entries[index] = new
+        if self._ledger is not None:
+            self._ledger.replace_entry(index, new)
+        return new
+
+    def remove_entry(self, index: int) -> PTOEntry:
+        removed = self.pto_entries.pop(index)
+        if self._ledger is not None:
+            self._ledger.remove_entry(index)
+        return removed
+
+    def balance_on(self, date, pto_type: str, state: str = 'planned') -> float:
+        """Balance of a PTO type key in a state (see lib.ledger.STATES) at the end of a date"""
+        return self.balances_on([date], pto_type, state)[0]
+
+    def balances_on(self, dates, pto_type: str, state: str = 'planned') -> List[float]:
+        """Like balance_on, for many dates at once"""
+        ledger = self.ledger
+        ti = ledger.type_keys.index(pto_type)
+        si = STATES.index(state)
+        return [ledger.balance_on(to_ordinal(d), ti, si) for d in dates]
+
+    def validation_context(self) -> Dict[str, Any]:
+        """The context this year's types and entries were validated with, to validate more of them"""
+        return {
+            'year': self.year,
+            'timezone': self.timezone,
+            'tzinfo': self.tzinfo,
+            'working_hours': self.working_hours,
+            'bank_holidays': self.bank_holidays,
+            'holidays': self.holidays,
+            'pto_types': self.pto_types,
+        }
+
+    @property
+    def ledger(self) -> Ledger:
+        if self._ledger is None:
+            with profiling.span('ledger'):
+                self._ledger = Ledger(self)
+        return self._ledger
+
     @property
     def adjustments(self):
-        out = []
-        for t in self.pto_types.values():
-            out += t.accruals
-        for e in self.pto_entries:
-            a = PTOAdjustment.model_validate({
-                'date': e.start,
-                'hours': -e.hours,
-            }, context={'year': self.year, 'timezone': self.timezone})
-            a.pto_type = self.pto_types[e.pto_type]
-            a.pto = e
-            out.append(a)
-        return out
+        return self.ledger.adjustments
 
 
 class PTOFile(BaseModel):
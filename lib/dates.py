@@ -1,9 +1,54 @@
-from typing import Optional, Self, List
+from typing import Optional, Self, List, Dict, Tuple
 from typing_extensions import Annotated
+import datetime
+import calendar
+import bisect
+from functools import cached_property, lru_cache
+from collections import OrderedDict
+import threading
 
 from pydantic import BaseModel, model_validator, AfterValidator
 import arrow
 
+from . import profiling
+
+def to_ordinal(date) -> int:
+    """Day ordinal of a date, datetime, Arrow or date string"""
+    if isinstance(date, str):
+        date = arrow.get(date)
+    return date.toordinal()
+
+
+@lru_cache(maxsize=None)
+def resolve_timezone(name: str) -> datetime.tzinfo:
+    """Timezone object for a name like 'US/Eastern', resolved once per name
+
+    The returned object keeps its own transition data, so reusing it avoids reloading DST rules per date.
+    """
+    return arrow.parser.TzinfoParser.parse(name)
+
+
+def parse_ordinal(value, tzinfo) -> int:
+    """Day ordinal of an input date in a timezone; plain YYYY-MM-DD strings skip arrow's parser"""
+    if isinstance(value, str):
+        try:
+            return datetime.date.fromisoformat(value).toordinal()
+        except ValueError:
+            pass
+    return arrow.get(value, tzinfo=tzinfo).toordinal()
+
+
+def to_arrow(ordinal: int, minute: int, tzinfo) -> arrow.arrow.Arrow:
+    """Arrow for a day ordinal and minutes past midnight, for output"""
+    dt = datetime.datetime.fromordinal(ordinal) + datetime.timedelta(minutes=minute)
+    return arrow.Arrow.fromdatetime(dt, tzinfo=tzinfo)
+
+
+def weekday(ordinal: int) -> int:
+    """ISO weekday of a day ordinal, 1 for Monday to 7 for Sunday"""
+    return (ordinal - 1) % 7 + 1
+
+
 def Ge(n):
     def GeImpl(v):
         if v < n:
@@ -51,43 +96,137 @@ class Holiday(BaseModel):
 
         return self
 
-    def get_for_year(self, year: int):
-        dt = arrow.get(year, self.month, self.day or 1)
-        lastmatch = found_dt = None
+    def date_for_year(self, year: int) -> Optional[datetime.date]:
         if self.day:
-            lastmatch = found_dt = dt
+            found = datetime.date(year, self.month, self.day)
         else:
-            occurrence = 0
-            while True:
-                if dt.isoweekday() == self.day_of_week:
-                    occurrence += 1
-                    lastmatch = arrow.get(dt)
-                    if occurrence == self.occurrence:
-                        found_dt = lastmatch
-                        break
-                dt = dt.shift(days=1)
-                if dt.month != self.month:
-                    break
+            days_in_month = calendar.monthrange(year, self.month)[1]
+            if self.occurrence == -1:
+                last = datetime.date(year, self.month, days_in_month)
+                found = last - datetime.timedelta(days=(last.isoweekday() - self.day_of_week) % 7)
+            else:
+                first_weekday = datetime.date(year, self.month, 1).isoweekday()
+                day = 1 + (self.day_of_week - first_weekday) % 7 + 7 * (self.occurrence - 1)
+                if day > days_in_month:
+                    return None
+                found = datetime.date(year, self.month, day)
 
-            if not found_dt and self.occurrence == -1 and lastmatch:
-                found_dt = lastmatch
+        if self.not_weekend and found.isoweekday() in (6, 7):
+            found -= datetime.timedelta(days=found.isoweekday() - 5)
 
-        if found_dt:
-            if self.not_weekend:
-                while found_dt.isoweekday() in (6, 7):
-                    found_dt = found_dt.shift(days=-1)
+        return found
 
-        return found_dt
+    def get_for_year(self, year: int):
+        found = self.date_for_year(year)
+        if found:
+            return arrow.get(found)
+        return None
 
 
 class HolidayList(BaseModel):
     holidays: List[Holiday]
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == 'holidays':
+            self.invalidate()
+
+    def invalidate(self):
+        """Drop the cached per-year indexes; call after modifying holidays in place"""
+        self.__dict__.pop('year_index', None)
+        self.__dict__.pop('weekday_ordinals', None)
+        self.__dict__.pop('business_day_bitmaps', None)
+        self.__dict__.pop('fingerprint', None)
+
+    # Caches live in the instance dict rather than in private attributes, which are much slower to read
+
+    @cached_property
+    def year_index(self) -> Dict[int, Dict[datetime.date, Holiday]]:
+        """Holidays by date, per year; filled on demand"""
+        return {}
+
+    @cached_property
+    def weekday_ordinals(self) -> Dict[int, List[int]]:
+        """Sorted ordinals of holidays falling on weekdays, per year; filled on demand"""
+        return {}
+
+    @cached_property
+    def business_day_bitmaps(self) -> Dict[int, bytes]:
+        """Business day bitmaps, per year; filled on demand"""
+        return {}
+
+    @cached_property
+    def fingerprint(self) -> Tuple:
+        """Hashable summary of the rules, equal for lists that produce the same dates whatever the names"""
+        return tuple(sorted({(h.month, h.day or 0, h.day_of_week or 0, h.occurrence or 0, h.not_weekend) for h in self.holidays}))
+
+    def for_year(self, year: int) -> Dict[datetime.date, Holiday]:
+        """Get all holidays falling in a year, by date"""
+        index = self.year_index.get(year)
+        if index is None:
+            index = {}
+            for h in self.holidays:
+                hdt = h.date_for_year(year)
+                if hdt and hdt.year == year:
+                    index.setdefault(hdt, h)
+            self.year_index[year] = index
+        return index
+
+    def dates_for_years(self, years) -> List[datetime.date]:
+        """Expand this calendar for many years at once, sorted and without duplicates"""
+        out = []
+        for year in years:
+            out += self.for_year(year).keys()
+        out.sort()
+        return out
+
+    def _holiday_ordinals(self, year: int) -> List[int]:
+        ordinals = self.weekday_ordinals.get(year)
+        if ordinals is None:
+            ordinals = sorted(d.toordinal() for d in self.for_year(year) if d.isoweekday() < 6)
+            self.weekday_ordinals[year] = ordinals
+        return ordinals
+
+    def business_days(self, year: int) -> bytes:
+        """One byte per day of a year from January 1st, 1 for weekdays that are not holidays and 0 otherwise"""
+        bitmap = self.business_day_bitmaps.get(year)
+        if bitmap is None:
+            first = datetime.date(year, 1, 1).toordinal()
+            last = datetime.date(year, 12, 31).toordinal()
+            holidays = set(self._holiday_ordinals(year))
+            bitmap = bytes(int(weekday(o) < 6 and o not in holidays) for o in range(first, last + 1))
+            self.business_day_bitmaps[year] = bitmap
+        return bitmap
+
+    def is_business_day(self, dt: datetime.date) -> bool:
+        profiling.count('holiday_lookups')
+        return dt.isoweekday() < 6 and dt not in self.for_year(dt.year)
+
+    def count_business_days(self, start: datetime.date, end: datetime.date) -> int:
+        """Count weekdays that are not holidays between start and end, inclusive"""
+        profiling.count('business_day_counts')
+        first, last = start.toordinal(), end.toordinal()
+        if last < first:
+            return 0
+
+        # Weekdays in the range: 5 per full week, plus the weekdays in the partial week
+        weeks, extra = divmod(last - first + 1, 7)
+        weekday = (first + 7 * weeks - 1) % 7
+        count = 5 * weeks + sum(1 for i in range(extra) if (weekday + i) % 7 < 5)
+
+        for year in range(start.year, end.year + 1):
+            ordinals = self._holiday_ordinals(year)
+            count -= bisect.bisect_right(ordinals, last) - bisect.bisect_left(ordinals, first)
+        return count
+
     def contains_date(self, dt: arrow.arrow.Arrow) -> Optional[Holiday]:
-        for h in self.holidays:
-            hdt = h.get_for_year(dt.year)
-            if hdt and hdt.year == dt.year and hdt.month == dt.month and hdt.day == dt.day:
-                return h
+        profiling.count('holiday_lookups')
+        return self.for_year(dt.year).get(datetime.date(dt.year, dt.month, dt.day))
+
+    def previous_non_holiday(self, ordinal: int) -> int:
+        while self.contains_date(datetime.date.fromordinal(ordinal)):
+            ordinal -= 1
+        return ordinal
 
     def find_previous_non_holiday_for_date(self, dt: arrow.arrow.Arrow) -> arrow.arrow.Arrow:
         while self.contains_date(dt):
@@ -95,6 +234,56 @@ class HolidayList(BaseModel):
         return dt
 
 
+SCHEDULE_CACHE_SIZE = 4096
+"""Accrual schedules kept by accrual_schedule(), least recently used are dropped first"""
+
+_schedules: 'OrderedDict[Tuple, Tuple[int, ...]]' = OrderedDict()
+_schedules_lock = threading.Lock()
+
+
+def accrual_schedule(year: int, accrual_weeks: Optional[int], accrual_days: Optional[List[int]], bank_holidays: HolidayList) -> Tuple[int, ...]:
+    """Day ordinals of a year's pay periods, every accrual_weeks or on accrual_days of each month (-1 for the last)
+
+    Schedules are shared process-wide: types with the same parameters and equivalent bank holidays get the same
+    tuple, so it must not be modified.
+    """
+    if accrual_weeks:
+        key = (year, accrual_weeks, None, None)
+    else:
+        key = (year, None, tuple(accrual_days), bank_holidays.fingerprint)
+    with _schedules_lock:
+        dates = _schedules.get(key)
+        if dates is not None:
+            _schedules.move_to_end(key)
+            return dates
+
+    profiling.count('accrual_schedules')
+    dates = _accrual_schedule(year, accrual_weeks, accrual_days, bank_holidays)
+    with _schedules_lock:
+        _schedules[key] = dates
+        if len(_schedules) > SCHEDULE_CACHE_SIZE:
+            _schedules.popitem(last=False)
+    return dates
+
+
+def _accrual_schedule(year: int, accrual_weeks: Optional[int], accrual_days: Optional[List[int]], bank_holidays: HolidayList) -> Tuple[int, ...]:
+    if accrual_weeks:
+        # TODO: this should have an actual start date; may not be 1/1
+        step = 7 * accrual_weeks
+        return tuple(range(datetime.date(year, 1, 1).toordinal() + step, datetime.date(year, 12, 31).toordinal() + 1, step))
+    dates = []
+    for month in range(1, 13):
+        for day in accrual_days:
+            if day == -1:
+                day = calendar.monthrange(year, month)[1]
+            ordinal = datetime.date(year, month, day).toordinal()
+            # Move weekends back to Friday
+            if weekday(ordinal) > 5:
+                ordinal -= weekday(ordinal) - 5
+            dates.append(bank_holidays.previous_non_holiday(ordinal))
+    return tuple(dates)
+
+
 HOLIDAYS = {
     'US': HolidayList(holidays=[
         Holiday(
@@ -0,0 +1,133 @@
+import sys
+import csv
+import json
+from typing import Optional, Iterable, Iterator, Dict, Any, List
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from . import profiling
+from .ledger import STATES
+
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+
+FIELDS = (
+    'file', 'collection', 'year', 'row', 'date', 'type', 'type_name', 'hours', 'state',
+    'id', 'name', 'start', 'end', 'days',
+    'tentative', 'requested', 'approved', 'travel', 'lodging', 'registration', 'roommates',
+) + tuple(f'balance_{k}' for k in STATES)
+"""Exported columns; balances are those of the row's type, after the row"""
+
+BATCH_SIZE = 10000
+"""Rows per Parquet record batch"""
+
+
+def ledger_rows(year, file: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Rows of a year's ledger in date order, as dicts of FIELDS"""
+    ledger = year.ledger
+    balances = ledger.balances
+    for row in range(len(ledger)):
+        pto = ledger.entry(row)
+        ti = ledger.type_index[row]
+        out = {
+            'file': file,
+            'collection': year.name,
+            'year': year.year,
+            'row': row + 1,
+            'date': ledger.date(row).isoformat(),
+            'type': ledger.type_keys[ti],
+            'type_name': ledger.pto_types[ti].name,
+            'hours': ledger.hours[row],
+            'state': ledger.state(row),
+            'id': ledger.entry_index[row] + 1 if pto else None,
+            'name': pto.name if pto else None,
+            'start': pto.start.isoformat() if pto else None,
+            'end': pto.end.isoformat() if pto else None,
+            'days': pto.days if pto else None,
+        }
+        for k in ('tentative', 'requested', 'approved', 'travel', 'lodging', 'registration', 'roommates'):
+            out[k] = getattr(pto, k) if pto else None
+        for si, k in enumerate(STATES):
+            out[f'balance_{k}'] = balances.at(row, ti, si)
+        yield out
+
+
+def format_for(path: str, fmt: Optional[str] = None) -> str:
+    """The export format, given or from the file extension; CSV for stdout"""
+    if fmt:
+        return fmt
+    if path == '-':
+        return 'csv'
+    for f, extensions in (('csv', ('.csv',)), ('jsonl', ('.jsonl', '.ndjson')), ('parquet', ('.parquet', '.pq'))):
+        if path.endswith(extensions):
+            return f
+    raise RuntimeError(f"Can't tell the export format of {path}, expected one of {', '.join(FORMATS)}")
+
+
+def write_csv(rows: Iterable[Dict[str, Any]], fp):
+    writer = csv.DictWriter(fp, FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+
+
+def write_jsonl(rows: Iterable[Dict[str, Any]], fp):
+    for row in rows:
+        fp.write(json.dumps(row) + '\n')
+
+
+def parquet_schema():
+    columns = []
+    for k in FIELDS:
+        if k in ('year', 'row', 'id'):
+            t = pyarrow.int32()
+        elif k in ('hours', 'days') or k.startswith('balance_'):
+            t = pyarrow.float64()
+        elif k in ('tentative', 'requested', 'approved', 'travel', 'lodging', 'registration', 'roommates'):
+            t = pyarrow.bool_()
+        else:
+            t = pyarrow.string()
+        columns.append(pyarrow.field(k, t))
+    return pyarrow.schema(columns)
+
+
+def write_parquet(rows: Iterable[Dict[str, Any]], path: str, batch_size: int = BATCH_SIZE):
+    """Write rows to a Parquet file a batch of columns at a time"""
+    if pyarrow is None:
+        raise RuntimeError("Parquet export requires pyarrow")
+    schema = parquet_schema()
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        columns: Dict[str, List[Any]] = {k: [] for k in FIELDS}
+        size = 0
+        for row in rows:
+            for k in FIELDS:
+                columns[k].append(row[k])
+            size += 1
+            if size >= batch_size:
+                writer.write_batch(pyarrow.RecordBatch.from_pydict(columns, schema=schema))
+                columns = {k: [] for k in FIELDS}
+                size = 0
+        if size:
+            writer.write_batch(pyarrow.RecordBatch.from_pydict(columns, schema=schema))
+
+
+@profiling.timed('export')
+def export(rows: Iterable[Dict[str, Any]], path: str, fmt: Optional[str] = None):
+    """Stream rows to a file, or to stdout if path is '-' (CSV unless fmt is set, Parquet isn't supported)"""
+    fmt = format_for(path, fmt)
+    if fmt == 'parquet':
+        if path == '-':
+            raise RuntimeError("Parquet can't be written to stdout")
+        write_parquet(rows, path)
+        return
+
+    write = write_csv if fmt == 'csv' else write_jsonl
+    if path == '-':
+        write(rows, sys.stdout)
+        return
+    with open(path, 'w', newline='' if fmt == 'csv' else None, encoding='utf-8') as fp:
+        write(rows, fp)
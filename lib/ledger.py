@@ -0,0 +1,245 @@
+from array import array
+from functools import cached_property
+from itertools import accumulate
+import bisect
+import datetime
+
+import arrow
+
+from . import profiling
+from .dates import to_arrow
+
+
+STATES = ('planned', 'tentative', 'requested', 'approved')
+"""Balances kept for every PTO type; each one includes the adjustments in a subset of entry states"""
+
+ENTRY_STATES = (None, 'Planned', 'Tentative', 'Requested', 'Approved', 'Denied')
+"""State of a ledger row, None being an accrual"""
+
+STATE_APPLIES = (
+    (1, 1, 1, 1),
+    (1, 1, 0, 0),
+    (0, 1, 0, 0),
+    (1, 1, 1, 0),
+    (1, 1, 1, 1),
+    (0, 0, 0, 0),
+)
+"""For each of ENTRY_STATES, whether a row counts towards each of STATES"""
+
+
+def entry_state(entry) -> int:
+    """Index into ENTRY_STATES of an entry, or of an accrual if entry is None"""
+    if entry is None:
+        return 0
+    if entry.approved is not None:
+        return 4 if entry.approved else 5
+    if entry.requested:
+        return 3
+    if entry.tentative:
+        return 2
+    return 1
+
+
+class PTOAdjustment:
+    """A single change to a PTO type's balance: an accrual, or the debit of an entry
+
+    Deliberately not a pydantic model, thousands of these are created per year and are never user input.
+    """
+
+    __slots__ = ('ordinal', 'minute', 'hours', 'tzinfo', 'pto_type', 'pto')
+
+    def __init__(self, ordinal: int, minute: int, hours: float, tzinfo: datetime.tzinfo, pto_type=None, pto=None):
+        self.ordinal = ordinal
+        """Day of this adjustment, as a date ordinal"""
+        self.minute = minute
+        """Time of day of this adjustment, in minutes past midnight"""
+        self.hours = hours
+        self.tzinfo = tzinfo
+        self.pto_type = pto_type
+        self.pto = pto
+        """The PTOEntry this adjustment debits, None for accruals"""
+
+    @property
+    def date(self) -> arrow.arrow.Arrow:
+        return to_arrow(self.ordinal, self.minute, self.tzinfo)
+
+    def __repr__(self):
+        return f'PTOAdjustment(date={self.date}, hours={self.hours})'
+
+
+class Balances:
+    """Running balance after each ledger row, for each type and state, as a flat rows x types x states matrix"""
+
+    def __init__(self, ledger: 'Ledger'):
+        self.types = len(ledger.pto_types)
+        self.states = len(STATES)
+        self.stride = self.types * self.states
+        self.values = array('d')
+        self.update(ledger, 0)
+
+    def update(self, ledger: 'Ledger', start: int):
+        """Recompute balances from row start on, after rows from there were inserted, removed or changed"""
+        size = len(ledger) * self.stride
+        if len(self.values) > size:
+            del self.values[size:]
+        else:
+            self.values.extend(array('d', bytes(8 * (size - len(self.values)))))
+
+        applies = [STATE_APPLIES[i] for i in ledger.state_index[start:]]
+        for t in range(self.types):
+            # Hours of this type's rows, 0 elsewhere
+            hours = [h if ti == t else 0.0 for h, ti in zip(ledger.hours[start:], ledger.type_index[start:])]
+            for s in range(self.states):
+                initial = self.at(start - 1, t, s) if start else 0.0
+                column = array('d', accumulate((h if a[s] else 0.0 for h, a in zip(hours, applies)), initial=initial))
+                self.values[start * self.stride + t * self.states + s::self.stride] = column[1:]
+        profiling.count('balance_rows', len(ledger) - start)
+
+    def at(self, row: int, type_index: int, state: int) -> float:
+        return self.values[row * self.stride + type_index * self.states + state]
+
+    def row(self, row: int) -> array:
+        """All balances after a row, ordered by type then state"""
+        return self.values[row * self.stride:(row + 1) * self.stride]
+
+
+class Ledger:
+    """All adjustments of a PTOYear in date order, stored as parallel arrays
+
+    Built once per year (see PTOYear.ledger) so that reports don't need to rebuild or revalidate adjustments.
+    Entries can then be added, replaced or removed in place, which only recomputes balances from the first
+    changed row on (see PTOYear.add_entries, edit_entry and remove_entry).
+    Row i is made of ordinals[i] (day ordinal), minutes[i] (minutes past midnight), hours[i] (signed),
+    type_index[i] (index into pto_types), entry_index[i] (index into pto_entries, -1 for accruals) and
+    accrual_index[i] (index into the type's accruals, -1 for entries) and state_index[i] (index into ENTRY_STATES).
+    """
+
+    def __init__(self, year):
+        self.year = year.year
+        self.tzinfo = year.tzinfo
+        self.type_keys = list(year.pto_types.keys())
+        self.pto_types = list(year.pto_types.values())
+        self.pto_entries = list(year.pto_entries)
+
+        self._type_lookup = {k: i for i, k in enumerate(self.type_keys)}
+
+        rows = []
+        for ti, t in enumerate(self.pto_types):
+            for ai, a in enumerate(t.accruals):
+                rows.append((a.ordinal, a.minute, a.hours, ti, -1, ai))
+        for ei, e in enumerate(self.pto_entries):
+            rows.append((e.start_ordinal, e.start_minute, -e.hours, self._type_lookup[e.pto_type], ei, -1))
+        # Stable, so ties keep accruals first in type order, then entries in file order
+        rows.sort(key=lambda r: (r[0], r[1]))
+
+        self.ordinals = array('l', (r[0] for r in rows))
+        self.minutes = array('l', (r[1] for r in rows))
+        self.hours = array('d', (r[2] for r in rows))
+        self.type_index = array('i', (r[3] for r in rows))
+        self.entry_index = array('i', (r[4] for r in rows))
+        self.accrual_index = array('i', (r[5] for r in rows))
+        self.state_index = array('b', (entry_state(self.entry(row)) for row in range(len(rows))))
+        profiling.count('ledger_rows', len(rows))
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def pto_type(self, row: int):
+        return self.pto_types[self.type_index[row]]
+
+    def entry(self, row: int):
+        """The PTOEntry of a row, or None for accruals"""
+        ei = self.entry_index[row]
+        if ei < 0:
+            return None
+        return self.pto_entries[ei]
+
+    def date(self, row: int) -> arrow.arrow.Arrow:
+        return to_arrow(self.ordinals[row], self.minutes[row], self.tzinfo)
+
+    def state(self, row: int) -> str:
+        return ENTRY_STATES[self.state_index[row]]
+
+    @cached_property
+    def balances(self) -> Balances:
+        with profiling.span('balances'):
+            return Balances(self)
+
+    def rows_through(self, ordinal: int) -> int:
+        """Number of rows dated on or before a day ordinal"""
+        return bisect.bisect_right(self.ordinals, ordinal)
+
+    def balance_on(self, ordinal: int, type_index: int, state: int) -> float:
+        """Balance at the end of a day, by binary search over the sorted rows"""
+        rows = self.rows_through(ordinal)
+        if not rows:
+            return 0.0
+        return self.balances.at(rows - 1, type_index, state)
+
+    @cached_property
+    def adjustments(self):
+        """Rows as PTOAdjustment objects, for callers that want objects rather than columns"""
+        out = []
+        for row in range(len(self)):
+            e = self.entry(row)
+            if e is None:
+                out.append(self.pto_type(row).accruals[self.accrual_index[row]])
+            else:
+                profiling.count('adjustments_built')
+                a = PTOAdjustment(e.start_ordinal, e.start_minute, -e.hours, self.tzinfo, self.pto_type(row), e)
+                out.append(a)
+        return out
+
+    def _position(self, ordinal: int, minute: int, entry_index: int) -> int:
+        """Row at which an entry goes, keeping the order of a full rebuild: accruals, then entries in file order"""
+        lo = bisect.bisect_left(self.ordinals, ordinal)
+        hi = bisect.bisect_right(self.ordinals, ordinal, lo)
+        while lo < hi and (self.minutes[lo], self.entry_index[lo]) < (minute, entry_index):
+            lo += 1
+        return lo
+
+    def _insert(self, entry_index: int) -> int:
+        e = self.pto_entries[entry_index]
+        row = self._position(e.start_ordinal, e.start_minute, entry_index)
+        self.ordinals.insert(row, e.start_ordinal)
+        self.minutes.insert(row, e.start_minute)
+        self.hours.insert(row, -e.hours)
+        self.type_index.insert(row, self._type_lookup[e.pto_type])
+        self.entry_index.insert(row, entry_index)
+        self.accrual_index.insert(row, -1)
+        self.state_index.insert(row, entry_state(e))
+        return row
+
+    def _remove(self, entry_index: int) -> int:
+        row = self.entry_index.index(entry_index)
+        for column in (self.ordinals, self.minutes, self.hours, self.type_index, self.entry_index, self.accrual_index, self.state_index):
+            del column[row]
+        return row
+
+    def _changed(self, row: int):
+        """Update what was computed from the rows, from row on"""
+        self.__dict__.pop('adjustments', None)
+        if 'balances' in self.__dict__:
+            self.balances.update(self, row)
+
+    def add_entries(self, entries: list):
+        """Add validated entries after the existing ones; balances are recomputed once, from the earliest of them"""
+        first = len(self)
+        for e in entries:
+            self.pto_entries.append(e)
+            first = min(first, self._insert(len(self.pto_entries) - 1))
+        self._changed(first)
+
+    def replace_entry(self, entry_index: int, entry):
+        """Replace an entry by a validated one, which may have a different date, duration, type or state"""
+        self.pto_entries[entry_index] = entry
+        first = self._remove(entry_index)
+        first = min(first, self._insert(entry_index))
+        self._changed(first)
+
+    def remove_entry(self, entry_index: int):
+        first = self._remove(entry_index)
+        del self.pto_entries[entry_index]
+        # Later entries move down one
+        self.entry_index = array('i', (i - 1 if i > entry_index else i for i in self.entry_index))
+        self._changed(first)
@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import cached_property
+from typing import Optional, List, Dict, Any
+
+import yaml
+
+from .data import PTOFile, PTOYear
+from . import cache, profiling
+
+
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+"""libyaml's loader if PyYAML was built with it, it produces the same results as the pure python one"""
+
+
+def find_file(path: Optional[str] = None) -> str:
+    if not path:
+        candidates = [
+            os.path.join('.', 'pto.yaml'),
+            os.path.join('.', 'pto.json'),
+            os.path.expanduser(os.path.join('~', 'pto.yaml')),
+            os.path.expanduser(os.path.join('~', 'pto.json')),
+        ]
+        for c in candidates:
+            if os.path.exists(c):
+                path = c
+                break
+    if not path:
+        raise RuntimeError("No pto.yaml found")
+    if not os.path.exists(path):
+        raise RuntimeError(f"File {path} does not exist")
+    return path
+
+
+def parse_document(content: bytes, path: str = '') -> Dict[str, Any]:
+    """Parse a pto.yaml document, or the equivalent JSON which is much faster to parse"""
+    with profiling.span('parse'):
+        return _parse_document(content, path)
+
+
+def _parse_document(content: bytes, path: str) -> Dict[str, Any]:
+    if path.endswith('.json') or content.lstrip()[:1] == b'{':
+        try:
+            return json.loads(content) or {}
+        except ValueError:
+            if path.endswith('.json'):
+                raise
+            # YAML flow mapping, not JSON
+    return yaml.load(content, Loader=SafeLoader) or {}
+
+
+class SourceFile:
+    """A pto.yaml file, read once and parsed only when its data is needed"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as fp:
+            self.content = fp.read()
+
+    @cached_property
+    def digest(self) -> str:
+        return hashlib.sha256(self.content).hexdigest()
+
+    @cached_property
+    def data(self) -> Dict[str, Any]:
+        return parse_document(self.content, self.path)
+
+
+def save_document(path: str, data: Dict[str, Any]):
+    """Write a parsed document back, as JSON or YAML depending on the file name; YAML comments are not kept"""
+    if path.endswith('.json'):
+        content = json.dumps(data, indent=2) + '\n'
+    else:
+        content = yaml.safe_dump(data, sort_keys=False, allow_unicode=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as fp:
+        fp.write(content)
+    os.replace(tmp, path)
+
+
+def raw_collections(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return data.get('collections') or []
+
+
+def raw_year(collection: Dict[str, Any]) -> Optional[int]:
+    try:
+        return int(collection.get('year'))
+    except (TypeError, ValueError):
+        return None
+
+
+def select_collections(data: Dict[str, Any], year: Optional[int] = None, name_filter: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Find collections by their raw year and name, before any validation"""
+    out = raw_collections(data)
+    if year is not None:
+        out = [c for c in out if raw_year(c) == year]
+    if name_filter:
+        out = [c for c in out if name_filter in str(c.get('name', ''))]
+    return out
+
+
+def gil_enabled() -> bool:
+    """False on free-threaded builds running without the GIL, where threads validate in parallel"""
+    return getattr(sys, '_is_gil_enabled', lambda: True)()
+
+
+def validate_year(collection: Dict[str, Any]) -> PTOYear:
+    """Validate a raw collection with a validation context of its own, so that collections can validate concurrently"""
+    return PTOYear.model_validate(collection, context={})
+
+
+def validate_collections(collections: List[Dict[str, Any]], jobs: Optional[int] = None, processes: bool = False) -> PTOFile:
+    """Validate only the given raw collections, in parallel in up to jobs threads, or processes if set
+
+    jobs defaults to the number of CPUs for processes or on free-threaded builds, otherwise to 1 since threads
+    would only contend for the GIL. Collections are in the given order whatever the number of jobs.
+    """
+    profiling.count('collections_validated', len(collections))
+    if jobs is None:
+        jobs = (os.cpu_count() or 1) if processes or not gil_enabled() else 1
+    jobs = min(jobs, len(collections))
+    with profiling.span('validate'):
+        if jobs <= 1:
+            years = [validate_year(c) for c in collections]
+        else:
+            pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+            with pool(max_workers=jobs) as executor:
+                years = list(executor.map(validate_year, collections))
+        return PTOFile.model_construct(collections=years)
+
+
+def load_year(source: SourceFile, year: int, name_filter: Optional[str] = None, use_cache: bool = True) -> PTOYear:
+    """Load and validate a single year from a file, resolving automatic rollover"""
+    from .rollover import RolloverChain
+
+    out = None
+    if use_cache:
+        out = cache.load(source.digest, 'year', year, name_filter)
+
+    if out is None:
+        data = source.data
+        years = select_collections(data, year, name_filter)
+        if not years:
+            raise RuntimeError("No entries for year {} (found {})".format(year, ', '.join((str(c.get('year')) for c in raw_collections(data)))))
+        if len(years) > 1:
+            raise RuntimeError("Ambiguous entries for year {} ({})".format(year, ', '.join((str(c.get('name')) for c in years))))
+        out = validate_collections(years).collections[0]
+        if use_cache:
+            cache.store(out, source.digest, 'year', year, name_filter)
+
+    if out.needs_rollover:
+        RolloverChain(source.data, name_filter, use_cache=use_cache).resolve(out)
+    return out
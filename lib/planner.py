@@ -0,0 +1,109 @@
+import bisect
+import datetime
+from itertools import accumulate
+from typing import Optional, List
+
+import arrow
+
+from . import profiling
+from .dates import to_arrow, to_ordinal
+from .ledger import STATES, STATE_APPLIES, entry_state
+
+
+class Placement:
+    """A stretch of consecutive days off, made of weekends, holidays, existing entries and the PTO days to take"""
+
+    __slots__ = ('first', 'last', 'days', 'hours', 'tzinfo')
+
+    def __init__(self, first: int, last: int, days: int, hours: float, tzinfo: datetime.tzinfo):
+        self.first = first
+        """First day off, as a date ordinal"""
+        self.last = last
+        """Last day off, as a date ordinal"""
+        self.days = days
+        """PTO days to take within the stretch"""
+        self.hours = hours
+        self.tzinfo = tzinfo
+
+    @property
+    def start(self) -> arrow.arrow.Arrow:
+        return to_arrow(self.first, 0, self.tzinfo)
+
+    @property
+    def end(self) -> arrow.arrow.Arrow:
+        return to_arrow(self.last, 0, self.tzinfo)
+
+    @property
+    def length(self) -> int:
+        """Days off in a row"""
+        return self.last - self.first + 1
+
+    def __repr__(self):
+        return f'Placement(start={self.start}, end={self.end}, days={self.days})'
+
+
+def best_placements(year, pto_type: str, days: Optional[float] = None, state: str = 'planned', after=None, limit: int = 10) -> List[Placement]:
+    """Where to take whole PTO days of a type to get the longest stretches off, best first
+
+    Up to `days` days are placed (all that the balance allows if None), never more than what stays available: a
+    stretch starting on a date costs at most the lowest balance in that state (see lib.ledger.STATES) from then
+    to the end of the year. Days already off through entries counting in that state extend stretches for free.
+    Stretches returned don't overlap; `after` restricts them to start on or after a date.
+    """
+    with profiling.span('plan'):
+        return _best_placements(year, pto_type, days, state, after, limit)
+
+
+def _best_placements(year, pto_type, days, state, after, limit):
+    ledger = year.ledger
+    ti = ledger.type_keys.index(pto_type)
+    si = STATES.index(state)
+    day_start, day_end = year.working_hours
+    day_hours = float(day_end - day_start)
+
+    first = datetime.date(year.year, 1, 1).toordinal()
+    last = datetime.date(year.year, 12, 31).toordinal()
+    work = bytearray(year.holidays.business_days(year.year))
+    for e in ledger.pto_entries:
+        if STATE_APPLIES[entry_state(e)][si]:
+            for o in range(max(e.start_ordinal, first), min(to_ordinal(e.end), last) + 1):
+                work[o - first] = 0
+
+    # worked[i] is the number of business days before day i, so a stretch [i, j) costs worked[j] - worked[i]
+    worked = list(accumulate(work, initial=0))
+
+    # Taking hours on a day lowers every balance from then on, so what can be spent is the lowest balance left
+    available = [0.0] * len(work)
+    lowest = float('inf')
+    for i in range(len(work) - 1, -1, -1):
+        rows = ledger.rows_through(first + i)
+        lowest = min(lowest, ledger.balances.at(rows - 1, ti, si) if rows else 0.0)
+        available[i] = lowest
+
+    begin = max(to_ordinal(after), first) - first if after is not None else 0
+    wanted = int(days) if days is not None else len(work)
+    candidates = []
+    for i in range(begin, len(work)):
+        # Only start right after a worked day, otherwise the stretch is part of a longer one
+        if i > begin and not work[i - 1]:
+            continue
+        budget = min(wanted, int(available[i] / day_hours + 1e-9))
+        if budget < 1:
+            continue
+        # Furthest end such that the stretch needs no more than budget business days
+        j = bisect.bisect_right(worked, worked[i] + budget, i) - 1
+        cost = worked[j] - worked[i]
+        if cost:
+            candidates.append((-(j - i), cost, i, j))
+    profiling.count('plan_candidates', len(candidates))
+
+    out = []
+    taken = []
+    for _, cost, i, j in sorted(candidates):
+        if any(i < b and a < j for a, b in taken):
+            continue
+        taken.append((i, j))
+        out.append(Placement(first + i, first + j - 1, cost, cost * day_hours, year.tzinfo))
+        if len(out) >= limit:
+            break
+    return out
@@ -0,0 +1,97 @@
+import time
+import json
+import functools
+import threading
+import contextlib
+from collections import Counter
+from typing import Dict, Any
+
+
+ENABLED = False
+"""Spans and counters are only recorded while this is set, see enable()"""
+
+SPANS: Dict[str, list] = {}
+"""Per span name, [number of times entered, total seconds]"""
+
+COUNTERS: Counter = Counter()
+
+_NULL = contextlib.nullcontext()
+
+_lock = threading.Lock()
+"""Guards SPANS and COUNTERS, which stages running in threads update concurrently"""
+
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+
+def reset():
+    SPANS.clear()
+    COUNTERS.clear()
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        with _lock:
+            stat = SPANS.setdefault(self.name, [0, 0.0])
+            stat[0] += 1
+            stat[1] += elapsed
+
+
+def span(name: str):
+    """Time a stage: `with span('parse'): ...`; nested spans are each timed in full"""
+    if not ENABLED:
+        return _NULL
+    return _Span(name)
+
+
+def timed(name: str):
+    """Decorator timing every call of a function as a span"""
+    def _timed(func):
+        @functools.wraps(func)
+        def _timed_wrap(*a, **ka):
+            if not ENABLED:
+                return func(*a, **ka)
+            with _Span(name):
+                return func(*a, **ka)
+        return _timed_wrap
+    return _timed
+
+
+def count(name: str, n: int = 1):
+    if ENABLED:
+        with _lock:
+            COUNTERS[name] += n
+
+
+def report() -> Dict[str, Any]:
+    return {
+        'spans': {k: {'calls': v[0], 'seconds': v[1]} for k, v in SPANS.items()},
+        'counters': dict(COUNTERS),
+    }
+
+
+def format_report(fmt: str = 'text') -> str:
+    if fmt == 'json':
+        return json.dumps(report(), indent=2)
+
+    lines = ['Span                      Calls      Time (ms)']
+    for k, (calls, seconds) in sorted(SPANS.items(), key=lambda i: -i[1][1]):
+        lines.append(f'{k:24} {calls:6} {seconds * 1000:14.2f}')
+    if COUNTERS:
+        lines.append('')
+        lines.append('Counter                   Count')
+        for k, v in sorted(COUNTERS.items()):
+            lines.append(f'{k:24} {v:6}')
+    return '\n'.join(lines)
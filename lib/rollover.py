@@ -0,0 +1,81 @@
+import json
+import hashlib
+from typing import Optional, Dict, Any
+
+from . import cache
+from .data import PTOYear
+from .ledger import STATES
+from .loader import select_collections, validate_collections
+
+
+CLOSING_STATE = STATES.index('planned')
+"""Balance carried into the next year by rollover: auto"""
+
+
+class RolloverChain:
+    """Computes rollover: auto from the chain of previous years' closing balances
+
+    Collections are matched by year and, like load_year, by an optional name filter. Closing balances are
+    memoized per year in memory and in the on-disk cache, keyed by a fingerprint of that year and every year
+    before it, so editing a later year never recomputes earlier ones.
+    """
+
+    def __init__(self, data: Dict[str, Any], name_filter: Optional[str] = None, use_cache: bool = True):
+        self.data = data
+        self.name_filter = name_filter
+        self.use_cache = use_cache
+        self._closing: Dict[int, Dict[str, float]] = {}
+        self._fingerprints: Dict[int, str] = {}
+
+    def _raw(self, year: int) -> Optional[Dict[str, Any]]:
+        years = select_collections(self.data, year, self.name_filter)
+        if len(years) > 1:
+            raise RuntimeError("Ambiguous entries for year {} ({})".format(year, ', '.join((str(c.get('name')) for c in years))))
+        return years[0] if years else None
+
+    def fingerprint(self, year: int) -> str:
+        """Hash of the raw collections for this year and all years before it"""
+        if year not in self._fingerprints:
+            raw = self._raw(year)
+            if raw is None:
+                self._fingerprints[year] = ''
+            else:
+                h = hashlib.sha256(json.dumps(raw, sort_keys=True, default=str).encode('utf-8'))
+                h.update(self.fingerprint(year - 1).encode('utf-8'))
+                self._fingerprints[year] = h.hexdigest()
+        return self._fingerprints[year]
+
+    def closing(self, year: int) -> Dict[str, float]:
+        """Closing balance of each type key for a year, empty if there is no such year"""
+        if year not in self._closing:
+            raw = self._raw(year)
+            result = {}
+            if raw is not None:
+                key = self.fingerprint(year)
+                cached = cache.load(key, 'closing') if self.use_cache else None
+                if cached is not None:
+                    result = cached
+                else:
+                    result = closing_balances(self.resolve(validate_collections([raw]).collections[0]))
+                    if self.use_cache:
+                        cache.store(result, key, 'closing')
+            self._closing[year] = result
+        return self._closing[year]
+
+    def remember(self, year: PTOYear):
+        """Record the closing balances of a year already validated and resolved, so closing() doesn't validate it again"""
+        self._closing[year.year] = closing_balances(year)
+
+    def resolve(self, year: PTOYear) -> PTOYear:
+        """Apply rollover to a year's rollover: auto types"""
+        if year.needs_rollover:
+            year.apply_rollover(self.closing(year.year - 1))
+        return year
+
+
+def closing_balances(year: PTOYear) -> Dict[str, float]:
+    ledger = year.ledger
+    if not len(ledger):
+        return {k: 0.0 for k in ledger.type_keys}
+    last = len(ledger) - 1
+    return {k: ledger.balances.at(last, ti, CLOSING_STATE) for ti, k in enumerate(ledger.type_keys)}
@@ -0,0 +1,256 @@
+import os
+import json
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Optional, List, Dict, Any, Tuple
+
+import arrow
+
+from .data import PTOYear
+from .ledger import STATES
+from .loader import SourceFile, raw_collections, raw_year, select_collections, validate_collections
+from .planner import best_placements
+from .rollover import RolloverChain
+
+
+class LoadedFile:
+    """A source file's validated years, keyed so that unchanged collections survive a reload"""
+
+    def __init__(self, source: SourceFile, years: Dict[int, Tuple[str, PTOYear]], errors: Dict[int, str]):
+        self.source = source
+        self.years = years
+        self.errors = errors
+
+
+class PTOService:
+    """Keeps validated years and their ledgers in memory, reloading only collections that changed on disk"""
+
+    def __init__(self, paths: List[str], name_filter: Optional[str] = None):
+        self.paths = paths
+        self.name_filter = name_filter
+        self.files: Dict[str, LoadedFile] = {}
+        self._stats: Dict[str, Tuple[int, int]] = {}
+        self._responses: Dict[Any, bytes] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        for path in paths:
+            self.reload(path)
+
+    def _key(self, chain: RolloverChain, raw: Dict[str, Any]) -> str:
+        """Unchanged collections keep their key; with rollover: auto, so must every earlier year"""
+        if any(isinstance(t, dict) and t.get('rollover') == 'auto' for t in (raw.get('pto_types') or {}).values()):
+            return chain.fingerprint(raw_year(raw))
+        return hashlib.sha256(json.dumps(raw, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def reload(self, path: str):
+        source = SourceFile(path)
+        previous = self.files.get(path)
+        if previous and previous.source.digest == source.digest:
+            return
+
+        old_years = previous.years if previous else {}
+        chain = RolloverChain(source.data, self.name_filter, use_cache=False)
+        years = {}
+        errors = {}
+        changed = {}
+        for year in sorted({raw_year(c) for c in raw_collections(source.data)} - {None}):
+            try:
+                matches = select_collections(source.data, year, self.name_filter)
+                if len(matches) != 1:
+                    if matches:
+                        errors[year] = "Ambiguous entries for year {} ({})".format(year, ', '.join((str(c.get('name')) for c in matches)))
+                    continue
+                key = self._key(chain, matches[0])
+                if year in old_years and old_years[year][0] == key:
+                    years[year] = old_years[year]
+                else:
+                    changed[year] = (key, matches[0])
+            except Exception as e:
+                errors[year] = f'{type(e).__name__}: {e}'
+
+        # Changed collections validate together, in parallel where validate_collections can
+        models = {}
+        try:
+            validated = validate_collections([raw for _, raw in changed.values()]).collections
+            models = dict(zip(changed, validated))
+        except Exception:
+            # Find which ones failed
+            for year, (_, raw) in changed.items():
+                try:
+                    models[year] = validate_collections([raw]).collections[0]
+                except Exception as e:
+                    errors[year] = f'{type(e).__name__}: {e}'
+
+        # Rollover needs the previous year resolved first
+        for year in sorted(set(years) | set(models)):
+            try:
+                if year in models:
+                    model = chain.resolve(models[year])
+                    model.ledger.balances
+                    years[year] = (changed[year][0], model)
+                # Later years' rollover: auto starts from this model rather than revalidating the year
+                chain.remember(years[year][1])
+            except Exception as e:
+                errors[year] = f'{type(e).__name__}: {e}'
+
+        with self._lock:
+            self.files[path] = LoadedFile(source, years, errors)
+            self._responses.clear()
+            self._generation += 1
+
+    def check_files(self):
+        """Reload any file whose size or modification time changed"""
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stat = (st.st_mtime_ns, st.st_size)
+            if self._stats.get(path, stat) != stat:
+                try:
+                    self.reload(path)
+                except Exception:
+                    # Likely a partial write, retry on the next check
+                    continue
+            self._stats[path] = stat
+
+    def watch(self, interval: float = 1.0) -> threading.Event:
+        """Check for changed files in the background until the returned event is set"""
+        for path in self.paths:
+            st = os.stat(path)
+            self._stats[path] = (st.st_mtime_ns, st.st_size)
+
+        def _watch():
+            while not stop.wait(interval):
+                self.check_files()
+
+        stop = threading.Event()
+        threading.Thread(target=_watch, daemon=True).start()
+        return stop
+
+    def _year(self, query: Dict[str, str]) -> PTOYear:
+        path = query.get('file') or self.paths[0]
+        loaded = self.files.get(path)
+        if loaded is None:
+            raise KeyError(f"Unknown file {path}")
+        if not query.get('year'):
+            raise ValueError("Missing parameter year")
+        year = int(query['year'])
+        if year in loaded.errors:
+            raise ValueError(loaded.errors[year])
+        if year not in loaded.years:
+            raise KeyError(f"No entries for year {year}")
+        return loaded.years[year][1]
+
+    def years(self, query: Dict[str, str]) -> Any:
+        path = query.get('file') or self.paths[0]
+        loaded = self.files[path]
+        return [{'year': c.get('year'), 'name': c.get('name')} for c in raw_collections(loaded.source.data)]
+
+    def balance(self, query: Dict[str, str]) -> Any:
+        """Closing balances, or at the end of date, by type key then state, optionally narrowed to one type and/or state"""
+        ledger = self._year(query).ledger
+        rows = len(ledger)
+        if query.get('date'):
+            rows = ledger.rows_through(arrow.get(query['date']).toordinal())
+        out = {}
+        for ti, key in enumerate(ledger.type_keys):
+            if query.get('type') and query['type'] != key:
+                continue
+            out[key] = {
+                state: ledger.balances.at(rows - 1, ti, si) if rows else 0.0
+                for si, state in enumerate(STATES)
+                if not query.get('state') or query['state'] == state
+            }
+        return out
+
+    def list(self, query: Dict[str, str]) -> Any:
+        ledger = self._year(query).ledger
+        rows = []
+        for row in range(len(ledger)):
+            entry = ledger.entry(row)
+            rows.append({
+                'date': str(ledger.date(row)),
+                'type': ledger.type_keys[ledger.type_index[row]],
+                'hours': ledger.hours[row],
+                'state': ledger.state(row),
+                'name': entry.name if entry else None,
+                'balances': {
+                    key: dict(zip(STATES, ledger.balances.row(row)[ti * len(STATES):(ti + 1) * len(STATES)]))
+                    for ti, key in enumerate(ledger.type_keys)
+                },
+            })
+        return rows
+
+    def plan(self, query: Dict[str, str]) -> Any:
+        """Best stretches off for days of a type, see lib.planner.best_placements"""
+        data = self._year(query)
+        placements = best_placements(
+            data,
+            query['type'],
+            float(query['days']) if query.get('days') else None,
+            query.get('state') or 'planned',
+            arrow.get(query['from']) if query.get('from') else None,
+            int(query.get('limit') or 10),
+        )
+        return [
+            {'start': str(p.start), 'end': str(p.end), 'length': p.length, 'days': p.days, 'hours': p.hours}
+            for p in placements
+        ]
+
+    def query(self, endpoint: str, query: Dict[str, str]) -> bytes:
+        """JSON response for an endpoint, cached until the next reload"""
+        key = (endpoint, tuple(sorted(query.items())))
+        with self._lock:
+            response = self._responses.get(key)
+            generation = self._generation
+        if response is None:
+            handler = {'years': self.years, 'balance': self.balance, 'list': self.list, 'plan': self.plan}.get(endpoint)
+            if handler is None:
+                raise KeyError(f"Unknown endpoint {endpoint}")
+            response = json.dumps(handler(query)).encode('utf-8')
+            with self._lock:
+                # Don't cache a response computed from data that was reloaded meanwhile
+                if generation == self._generation:
+                    self._responses[key] = response
+        return response
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service: PTOService = None
+    verbose: bool = False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            body = self.service.query(url.path.strip('/'), query)
+            status = 200
+        except KeyError as e:
+            body, status = json.dumps({'error': str(e.args[0] if e.args else e)}).encode('utf-8'), 404
+        except Exception as e:
+            body, status = json.dumps({'error': f'{type(e).__name__}: {e}'}).encode('utf-8'), 400
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def serve(service: PTOService, host: str = '127.0.0.1', port: int = 8642, interval: float = 1.0, verbose: bool = False):
+    """Answer /years, /balance, /list and /plan queries over HTTP until interrupted, reloading files as they change"""
+    handler = type('Handler', (_Handler,), {'service': service, 'verbose': verbose})
+    stop = service.watch(interval)
+    with ThreadingHTTPServer((host, port), handler) as httpd:
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
@@ -0,0 +1,167 @@
+from array import array
+from bisect import bisect_right
+from typing import Optional, List, Dict, Any, Tuple
+
+from . import profiling
+from .data import PTOEntry
+from .dates import to_arrow
+from .ledger import STATES, STATE_APPLIES, entry_state
+
+
+EPSILON = 1e-9
+"""Balances above -EPSILON are not negative, to ignore float rounding"""
+
+
+class _Column:
+    """Balances of one type and state after each ledger row, with minima of every power of two long range"""
+
+    def __init__(self, values: array):
+        self.levels = [values]
+        width = 1
+        while 2 * width <= len(values):
+            prev = self.levels[-1]
+            size = len(values) - 2 * width + 1
+            self.levels.append(array('d', map(min, prev[:size], prev[width:width + size])))
+            width *= 2
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def at(self, row: int) -> float:
+        return self.levels[0][row] if row >= 0 else 0.0
+
+    def min(self, start: int, end: int) -> float:
+        """Lowest balance of rows start to end, excluding end, which must be greater than start"""
+        j = (end - start).bit_length() - 1
+        level = self.levels[j]
+        return min(level[start], level[end - (1 << j)])
+
+    def first_below(self, start: int, value: float) -> int:
+        """First row from start on with a balance below value, or the number of rows if none"""
+        size = len(self)
+        for j in range(len(self.levels) - 1, -1, -1):
+            if start + (1 << j) <= size and self.levels[j][start] >= value:
+                start += 1 << j
+        return start
+
+
+class Simulation:
+    """Evaluates hypothetical entries against a year's ledger, without modifying or copying it
+
+    Each type and state's balances are indexed once, on first use, so that every scenario then costs a few
+    binary searches per entry whatever the size of the ledger. Scenario entries go after the ledger's own rows
+    at the same date and time, as if they were added at the end of the file.
+    """
+
+    def __init__(self, year):
+        self.year = year
+        self.ledger = year.ledger
+        self.context = year.validation_context()
+        self._keys = [o * 1440 + m for o, m in zip(self.ledger.ordinals, self.ledger.minutes)]
+        self._columns: Dict[int, _Column] = {}
+        self._base: Dict[int, Tuple[float, Optional[Tuple[int, int]]]] = {}
+
+    def _column(self, c: int) -> _Column:
+        column = self._columns.get(c)
+        if column is None:
+            stride = len(self.ledger.pto_types) * len(STATES)
+            column = self._columns[c] = _Column(self.ledger.balances.values[c::stride])
+        return column
+
+    def _when(self, row: int) -> Tuple[int, int]:
+        return self.ledger.ordinals[row], self.ledger.minutes[row]
+
+    def _base_result(self, c: int) -> Tuple[float, Optional[Tuple[int, int]]]:
+        """Lowest balance and when it first goes negative, for a column no scenario entry touches"""
+        if c not in self._base:
+            column = self._column(c)
+            if not len(column):
+                self._base[c] = (0.0, None)
+            else:
+                row = column.first_below(0, -EPSILON)
+                self._base[c] = (column.min(0, len(column)), self._when(row) if row < len(column) else None)
+        return self._base[c]
+
+    def _evaluate_column(self, c: int, debits: List[Tuple[int, float, PTOEntry]]) -> Tuple[float, Optional[Tuple[int, int]]]:
+        """Lowest balance and when it first goes negative, with debits (row before which each goes, hours, entry) applied"""
+        column = self._column(c)
+        lowest = float('inf')
+        negative = None
+        debited = 0.0
+        start = 0
+        for row, hours, entry in debits + [(len(column), 0.0, None)]:
+            # Ledger rows from start up to row are lowered by what was debited so far
+            if row > start:
+                lowest = min(lowest, column.min(start, row) - debited)
+                if negative is None:
+                    below = column.first_below(start, debited - EPSILON)
+                    if below < row:
+                        negative = self._when(below)
+            if entry is None:
+                break
+            debited += hours
+            value = column.at(row - 1) - debited
+            lowest = min(lowest, value)
+            if negative is None and value < -EPSILON:
+                negative = (entry.start_ordinal, entry.start_minute)
+            start = row
+        return (0.0 if lowest == float('inf') else lowest), negative
+
+    def validate(self, entries: List[Any]) -> List[PTOEntry]:
+        return [e if isinstance(e, PTOEntry) else PTOEntry.model_validate(e, context=self.context) for e in entries]
+
+    def evaluate(self, entries: List[Any]) -> Dict[str, Any]:
+        """Earliest date any balance goes negative and the lowest balance reached, with entries added
+
+        Entries may be PTOEntry objects or raw entries, which are validated like the year's own. Dates are None
+        if no balance goes negative; types are keys and states are from lib.ledger.STATES.
+        """
+        profiling.count('scenarios')
+        ledger = self.ledger
+        states = len(STATES)
+        entries = sorted(self.validate(entries), key=lambda e: (e.start_ordinal, e.start_minute))
+
+        debits: Dict[int, List[Tuple[int, float, PTOEntry]]] = {}
+        for e in entries:
+            row = bisect_right(self._keys, e.start_ordinal * 1440 + e.start_minute)
+            ti = ledger.type_keys.index(e.pto_type)
+            for si, applies in enumerate(STATE_APPLIES[entry_state(e)]):
+                if applies:
+                    debits.setdefault(ti * states + si, []).append((row, e.hours, e))
+
+        out = {'negative': None, 'negative_type': None, 'negative_state': None, 'minimum': None, 'minimum_type': None, 'minimum_state': None}
+        first = None
+        for c in range(len(ledger.pto_types) * states):
+            if c in debits:
+                lowest, negative = self._evaluate_column(c, debits[c])
+            else:
+                lowest, negative = self._base_result(c)
+            key, state = ledger.type_keys[c // states], STATES[c % states]
+            if out['minimum'] is None or lowest < out['minimum']:
+                out.update(minimum=lowest, minimum_type=key, minimum_state=state)
+            if negative is not None and (first is None or negative < first):
+                first = negative
+                out.update(negative_type=key, negative_state=state)
+        if first is not None:
+            out['negative'] = to_arrow(first[0], first[1], ledger.tzinfo)
+        return out
+
+    def run(self, scenarios: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Evaluate scenarios, each a dict of a name and pto_entries; errors are returned, not raised"""
+        with profiling.span('simulate'):
+            out = []
+            for n, scenario in enumerate(scenarios):
+                result = {'name': scenario.get('name') or f'Scenario {n + 1}', 'error': None}
+                try:
+                    result.update(self.evaluate(scenario.get('pto_entries') or []))
+                except Exception as e:
+                    result['error'] = f'{type(e).__name__}: {e}'
+                out.append(result)
+            return out
+
+
+def raw_scenarios(data: Any) -> List[Dict[str, Any]]:
+    """Scenarios from a parsed document: a list, or a document with scenarios, each a list of entries or a dict"""
+    if isinstance(data, dict):
+        data = data.get('scenarios') or []
+    return [{'pto_entries': s} if isinstance(s, list) else s for s in data]
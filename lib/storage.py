@@ -0,0 +1,258 @@
+import os
+import json
+import sqlite3
+import hashlib
+from typing import Optional, List, Dict, Any, Tuple
+
+from . import cache, profiling
+from .data import PTOYear
+from .rollover import RolloverChain
+from .loader import raw_year, validate_collections
+
+
+EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+"""Files with these extensions are opened as a Store rather than parsed as pto.yaml"""
+
+SCHEMA = '''
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE IF NOT EXISTS collections (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    year INTEGER,
+    name TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS collections_year ON collections (year, position);
+
+CREATE TABLE IF NOT EXISTS pto_types (
+    collection_id INTEGER NOT NULL REFERENCES collections (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (collection_id, key)
+);
+
+CREATE TABLE IF NOT EXISTS pto_entries (
+    collection_id INTEGER NOT NULL REFERENCES collections (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    pto_type TEXT,
+    start TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (collection_id, position)
+);
+CREATE INDEX IF NOT EXISTS pto_entries_start ON pto_entries (collection_id, start);
+CREATE INDEX IF NOT EXISTS pto_entries_type_start ON pto_entries (collection_id, pto_type, start);
+
+CREATE TABLE IF NOT EXISTS accruals (
+    collection_id INTEGER NOT NULL REFERENCES collections (id) ON DELETE CASCADE,
+    pto_type TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    minute INTEGER NOT NULL,
+    hours REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS accruals_type_date ON accruals (collection_id, pto_type, ordinal);
+'''
+
+
+def is_store(path: Optional[str]) -> bool:
+    return bool(path) and path.endswith(EXTENSIONS)
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, default=str)
+
+
+class StoreRolloverChain(RolloverChain):
+    """RolloverChain reading previous years from a Store rather than from a parsed document"""
+
+    def __init__(self, store: 'Store', name_filter: Optional[str] = None, use_cache: bool = True):
+        super().__init__({}, name_filter, use_cache)
+        self.store = store
+
+    def _raw(self, year: int) -> Optional[Dict[str, Any]]:
+        years = [raw for _, raw in self.store.select(year, self.name_filter)]
+        if len(years) > 1:
+            raise RuntimeError("Ambiguous entries for year {} ({})".format(year, ', '.join((str(c.get('name')) for c in years))))
+        return years[0] if years else None
+
+
+class Store:
+    """PTO data kept in an SQLite database, as an alternative to a single pto.yaml file
+
+    Collections, types and entries are rows holding their raw fields as JSON, so a document round-trips
+    through import_document and export_document, and reading a year only reads that year's rows. Accruals
+    computed when a collection is saved are stored as well, so they can be queried without validating.
+    """
+
+    def __init__(self, path: str, create: bool = False):
+        """Open a store, which must exist unless create is set"""
+        if not create and not os.path.exists(path):
+            raise RuntimeError(f"File {path} does not exist")
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def years(self) -> List[Dict[str, Any]]:
+        """Year and name of every collection, without reading their types or entries"""
+        rows = self.connection.execute('SELECT year, name FROM collections ORDER BY position')
+        return [{'year': year, 'name': name} for year, name in rows]
+
+    def select(self, year: Optional[int] = None, name_filter: Optional[str] = None) -> List[Tuple[int, Dict[str, Any]]]:
+        """Raw collections and their ids, by year and name like loader.select_collections"""
+        sql = 'SELECT id, data FROM collections WHERE 1'
+        params = []
+        if year is not None:
+            sql += ' AND year = ?'
+            params.append(year)
+        if name_filter:
+            sql += ' AND instr(name, ?) > 0'
+            params.append(name_filter)
+        rows = self.connection.execute(sql + ' ORDER BY position', params).fetchall()
+        return [(cid, self._raw(cid, data)) for cid, data in rows]
+
+    def _raw(self, cid: int, data: str) -> Dict[str, Any]:
+        raw = json.loads(data)
+        raw['pto_types'] = {
+            key: json.loads(t)
+            for key, t in self.connection.execute('SELECT key, data FROM pto_types WHERE collection_id = ? ORDER BY position', (cid,))
+        }
+        raw['pto_entries'] = [
+            json.loads(e)
+            for e, in self.connection.execute('SELECT data FROM pto_entries WHERE collection_id = ? ORDER BY position', (cid,))
+        ]
+        return raw
+
+    def entries(self, year: int, pto_type: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Raw entries of a year's collections, optionally of a type key and starting between two ISO dates inclusive"""
+        sql = 'SELECT e.data FROM pto_entries e JOIN collections c ON c.id = e.collection_id WHERE c.year = ?'
+        params = [year]
+        if pto_type is not None:
+            sql += ' AND e.pto_type = ?'
+            params.append(pto_type)
+        if start is not None:
+            sql += ' AND e.start >= ?'
+            params.append(start)
+        if end is not None:
+            sql += ' AND e.start <= ?'
+            params.append(end)
+        sql += ' ORDER BY c.position, e.position'
+        return [json.loads(e) for e, in self.connection.execute(sql, params)]
+
+    def accruals(self, year: int, pto_type: str) -> List[Tuple[int, int, float]]:
+        """Stored accruals of a year's type key, as (day ordinal, minutes past midnight, hours) in date order"""
+        rows = self.connection.execute(
+            'SELECT a.ordinal, a.minute, a.hours FROM accruals a JOIN collections c ON c.id = a.collection_id'
+            ' WHERE c.year = ? AND a.pto_type = ? ORDER BY a.ordinal, a.minute',
+            (year, pto_type),
+        )
+        return rows.fetchall()
+
+    def load_year(self, year: int, name_filter: Optional[str] = None, use_cache: bool = True) -> PTOYear:
+        """Load and validate a single year, reading only its rows, resolving automatic rollover"""
+        with profiling.span('store.read'):
+            years = self.select(year, name_filter)
+        if not years:
+            raise RuntimeError("No entries for year {} (found {})".format(year, ', '.join((str(c['year']) for c in self.years()))))
+        if len(years) > 1:
+            raise RuntimeError("Ambiguous entries for year {} ({})".format(year, ', '.join((str(c.get('name')) for _, c in years))))
+        raw = years[0][1]
+
+        out = None
+        digest = hashlib.sha256(_dumps(raw).encode('utf-8')).hexdigest()
+        if use_cache:
+            out = cache.load(digest, 'year')
+        if out is None:
+            out = validate_collections([raw]).collections[0]
+            if use_cache:
+                cache.store(out, digest, 'year')
+
+        if out.needs_rollover:
+            StoreRolloverChain(self, name_filter, use_cache=use_cache).resolve(out)
+        return out
+
+    def _insert(self, position: int, raw: Dict[str, Any]) -> int:
+        fields = {k: v for k, v in raw.items() if k not in ('pto_types', 'pto_entries')}
+        cursor = self.connection.execute(
+            'INSERT INTO collections (position, year, name, data) VALUES (?, ?, ?, ?)',
+            (position, raw_year(raw), raw.get('name'), _dumps(fields)),
+        )
+        cid = cursor.lastrowid
+        self._write_rows(cid, raw)
+        return cid
+
+    def _write_rows(self, cid: int, raw: Dict[str, Any]):
+        self.connection.execute('DELETE FROM pto_types WHERE collection_id = ?', (cid,))
+        self.connection.execute('DELETE FROM pto_entries WHERE collection_id = ?', (cid,))
+        self.connection.executemany(
+            'INSERT INTO pto_types (collection_id, position, key, data) VALUES (?, ?, ?, ?)',
+            ((cid, n, key, _dumps(t)) for n, (key, t) in enumerate((raw.get('pto_types') or {}).items())),
+        )
+        self.connection.executemany(
+            'INSERT INTO pto_entries (collection_id, position, pto_type, start, data) VALUES (?, ?, ?, ?, ?)',
+            (
+                (cid, n, e.get('pto_type'), str(e['start'])[:10] if e.get('start') is not None else None, _dumps(e))
+                for n, e in enumerate(raw.get('pto_entries') or [])
+            ),
+        )
+
+    def _write_accruals(self, cid: int, year: PTOYear):
+        self.connection.execute('DELETE FROM accruals WHERE collection_id = ?', (cid,))
+        self.connection.executemany(
+            'INSERT INTO accruals (collection_id, pto_type, ordinal, minute, hours) VALUES (?, ?, ?, ?, ?)',
+            ((cid, key, a.ordinal, a.minute, a.hours) for key, t in year.pto_types.items() for a in t.accruals),
+        )
+
+    def _refresh_accruals(self, cid: int, raw: Dict[str, Any], name_filter: Optional[str] = None):
+        """Validate a stored collection to store its accruals, resolving rollover like load_year with name_filter"""
+        year = validate_collections([raw]).collections[0]
+        if year.needs_rollover:
+            StoreRolloverChain(self, name_filter, use_cache=False).resolve(year)
+        self._write_accruals(cid, year)
+
+    def import_document(self, data: Dict[str, Any], name_filter: Optional[str] = None):
+        """Replace everything in the store by a parsed pto.yaml document
+
+        Rollover: auto is resolved from the previous year's collection matching name_filter, as in load_year.
+        """
+        with profiling.span('store.write'), self.connection:
+            self.connection.execute('DELETE FROM collections')
+            ids = [self._insert(n, raw) for n, raw in enumerate(data.get('collections') or [])]
+            for cid, raw in zip(ids, data.get('collections') or []):
+                self._refresh_accruals(cid, raw, name_filter)
+
+    def export_document(self) -> Dict[str, Any]:
+        """The whole store as a pto.yaml document"""
+        return {'collections': [raw for _, raw in self.select()]}
+
+    def save_collection(self, cid: int, raw: Dict[str, Any], year: Optional[PTOYear] = None, name_filter: Optional[str] = None):
+        """Write back the types and entries of a collection from select(), and its accruals from the validated year
+
+        Accruals of later years matching name_filter with rollover: auto are refreshed too, since they depend on
+        this one.
+        """
+        with profiling.span('store.write'), self.connection:
+            self._write_rows(cid, raw)
+            if year is not None:
+                self._write_accruals(cid, year)
+            else:
+                self._refresh_accruals(cid, raw, name_filter)
+            sql = 'SELECT id, data FROM collections WHERE year > (SELECT year FROM collections WHERE id = ?)'
+            params = [cid]
+            if name_filter:
+                sql += ' AND instr(name, ?) > 0'
+                params.append(name_filter)
+            later = self.connection.execute(sql + ' ORDER BY year, position', params).fetchall()
+            for later_id, data in later:
+                later_raw = self._raw(later_id, data)
+                if any(isinstance(t, dict) and t.get('rollover') == 'auto' for t in later_raw['pto_types'].values()):
+                    self._refresh_accruals(later_id, later_raw, name_filter)
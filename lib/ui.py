@@ -1,27 +1,34 @@
+import sys
+from itertools import islice, chain
+
 from tabulate import tabulate
 
+from . import profiling
+
 
 class Table:
     def __init__(self, args, items, columns):
         self.verbosity = args.verbose
-        self.items = list(items)
+        self.streaming = getattr(args, 'stream', False)
+        self.page = getattr(args, 'page', None)
+        self.items = items
         self.columns = {}
         default = {
             'verbosity': 0,
             'getter': lambda i, k: getattr(i, k, None),
             'formatter': lambda v: '' if v is None else v,
             'formatter_nonempty': lambda v: v,
+            'width': None,
         }
         for k, v in columns.items():
             if isinstance(v, str):
                 v = {'label': v}
             self.columns[k] = dict(default, **v)
 
+    def _visible_columns(self):
+        return {k: c for k, c in self.columns.items() if c['verbosity'] <= self.verbosity}
 
-    def render(self):
-        columns = {k: c for k, c in self.columns.items() if c['verbosity'] <= self.verbosity}
-        headers = [c['label'] for c in columns.values()]
-        rows = []
+    def _rows(self, columns):
         for i in self.items:
             r = []
             for k, c in columns.items():
@@ -31,8 +38,71 @@ class Table:
                 else:
                     v = c['formatter'](v)
                 r.append(v)
-            rows.append(r)
-        return tabulate(rows, headers=headers)
+            yield r
+
+    @profiling.timed('render')
+    def render(self):
+        columns = self._visible_columns()
+        headers = [c['label'] for c in columns.values()]
+        return tabulate(list(self._rows(columns)), headers=headers)
+
+    @profiling.timed('render')
+    def stream(self, fp=None, sample=100, page=None):
+        """Write the table row by row as rows are produced
+
+        Column widths are fixed up front, from the column's 'width' if set, otherwise from the headers and the
+        first `sample` rows; longer values later on are not truncated. If page is set, headers are repeated
+        every `page` rows.
+        """
+        fp = fp or sys.stdout
+        columns = self._visible_columns()
+        headers = [c['label'] for c in columns.values()]
+        rows = self._rows(columns)
+        first = [[_cell(v) for v in r] for r in islice(rows, sample)]
+
+        widths = []
+        numeric = []
+        for n, c in enumerate(columns.values()):
+            values = [r[n] for r in first if r[n] != '']
+            widths.append(c['width'] or max([len(headers[n])] + [len(v) for v in values]))
+            numeric.append(bool(values) and all(_is_number(v) for v in values))
+
+        def _line(cells):
+            return '  '.join(
+                (v.rjust(w) if right else v.ljust(w))
+                for v, w, right in zip(cells, widths, numeric)
+            ).rstrip()
+
+        header = _line(headers) + '\n' + '  '.join('-' * w for w in widths) + '\n'
+        for n, r in enumerate(chain(first, ([_cell(v) for v in r] for r in rows))):
+            if n == 0 or (page and n % page == 0):
+                if n:
+                    fp.write('\n')
+                fp.write(header)
+            fp.write(_line(r) + '\n')
+        if not first:
+            fp.write(header)
+
+    def show(self, fp=None):
+        """Print the table, streamed if requested on the command line"""
+        if self.streaming:
+            self.stream(fp=fp, page=self.page)
+        else:
+            print(self.render(), file=fp or sys.stdout)
 
     def __str__(self):
         return self.render()
+
+
+def _cell(v):
+    if isinstance(v, float):
+        return format(v, 'g')
+    return str(v)
+
+
+def _is_number(v):
+    try:
+        float(v)
+    except ValueError:
+        return False
+    return True
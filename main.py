@@ -1,7 +1,6 @@
 import sys
 import argparse
 import functools
-import os
 import re
 from types import SimpleNamespace
 
@@ -9,7 +8,15 @@ import arrow
 import yaml
 # from colorist import Color, Effect
 
-from lib.data import PTOFile
+from lib import loader, profiling
+from lib.batch import expand_paths, run_batch
+from lib.server import PTOService, serve
+from lib.loader import SourceFile, find_file, raw_collections, save_document, select_collections
+from lib.ledger import STATES
+from lib.planner import best_placements
+from lib.simulate import Simulation, raw_scenarios
+from lib.storage import Store, is_store
+from lib.export import FORMATS, export, ledger_rows
 from lib.ui import Table
 
 
@@ -394,120 +401,286 @@ from lib.ui import Table
 
 
 def load_file(args):
-    path = args.file
-    if not path:
-        candidates = [
-            os.path.join('.', 'pto.yaml'),
-            os.path.expanduser(os.path.join('~', 'pto.yaml')),
-        ]
-        for c in candidates:
-            if os.path.exists(c):
-                path = c
-                break
-    if not path:
-        raise RuntimeError("No pto.yaml found")
-    if not os.path.exists(path):
-        raise RuntimeError(f"File {path} does not exist")
-
-    with open(path, 'r') as fp:
-        data = yaml.load(fp, Loader=yaml.SafeLoader)
-
-    return PTOFile.model_validate(data, context={})
-
-
-def load_year(args, data):
-    years = [c for c in data.collections if c.year == args.year]
-    if args.filter:
-        years = [c for c in years if args.filter in c.name]
-
-    if years:
-        if len(years) > 1:
-            raise RuntimeError("Ambiguous entries for year {} ({})".format(args.year, ', '.join((c.name for c in years))))
-        return years[0]
-    raise RuntimeError("No entries for year {} (found {})".format(args.year, ', '.join((str(c.year) for c in data.collections))))
-
-
-def list_years(args, data):
-    print(Table(
+    if is_store(args.file):
+        return Store(args.file)
+    return SourceFile(find_file(args.file))
+
+
+def load_year(args, source):
+    if isinstance(source, Store):
+        return source.load_year(args.year, args.filter, use_cache=not args.no_cache)
+    return loader.load_year(source, args.year, args.filter, use_cache=not args.no_cache)
+
+
+def transfer_document(args):
+    """Import a YAML or JSON file into an SQLite store, or export a store to one"""
+    if not is_store(args.file):
+        raise RuntimeError("--import-document and --export-document need -f to be a .db, .sqlite or .sqlite3 file")
+    with Store(args.file, create=bool(args.import_document)) as store:
+        if args.import_document:
+            document = SourceFile(args.import_document).data
+            store.import_document(document, args.filter)
+            print(f"Imported {len(raw_collections(document))} collections from {args.import_document} into {store.path}")
+        if args.export_document:
+            document = store.export_document()
+            save_document(args.export_document, document)
+            print(f"Exported {len(raw_collections(document))} collections from {store.path} to {args.export_document}")
+
+
+PARSED_FIELDS = ('hours', 'days', 'start_half', 'end_half', 'tentative', 'requested', 'approved', 'travel', 'lodging', 'registration', 'roommates')
+"""Entry fields whose FIELD=VALUE values are parsed as YAML scalars (numbers and booleans)"""
+
+
+def _arg_fields(pairs):
+    """Entry fields from FIELD=VALUE arguments; values stay strings except for PARSED_FIELDS"""
+    fields = {}
+    for pair in pairs:
+        k, sep, v = pair.partition('=')
+        if not sep:
+            raise RuntimeError(f"Expected FIELD=VALUE, got {pair}")
+        k = k.strip()
+        if not v:
+            value = None
+        elif k in PARSED_FIELDS:
+            value = yaml.safe_load(v)
+        else:
+            value = v
+        fields[k] = value
+    return fields
+
+
+def _entry_index(data, value):
+    index = int(value) - 1
+    if not 0 <= index < len(data.pto_entries):
+        raise RuntimeError(f"No entry {value} in {data.name}, entries are numbered 1 to {len(data.pto_entries)}")
+    return index
+
+
+def edit_entries(args, source, data):
+    """Add, edit or remove entries of a year in place, then write the file back"""
+    if isinstance(source, Store):
+        collection_id, raw = source.select(data.year, args.filter)[0]
+    else:
+        raw = select_collections(source.data, data.year, args.filter)[0]
+    raw_entries = raw.setdefault('pto_entries', [])
+
+    if args.import_entries:
+        imported = SourceFile(args.import_entries).data
+        if isinstance(imported, dict):
+            imported = imported.get('pto_entries') or []
+        data.add_entries(imported)
+        raw_entries += imported
+        print(f"Imported {len(imported)} entries into {data.name}")
+
+    if args.add_entry:
+        entry = _arg_fields(args.add_entry)
+        added = data.add_entry(entry)
+        raw_entries.append(entry)
+        print(f"Added entry {len(raw_entries)} {added.name} to {data.name}")
+
+    if args.edit_entry:
+        index = _entry_index(data, args.edit_entry[0])
+        entry = dict(raw_entries[index], **_arg_fields(args.edit_entry[1:]))
+        entry = {k: v for k, v in entry.items() if v is not None}
+        edited = data.edit_entry(index, entry)
+        raw_entries[index] = entry
+        print(f"Updated entry {index + 1} {edited.name} in {data.name}")
+
+    if args.remove_entry:
+        index = _entry_index(data, args.remove_entry)
+        removed = data.remove_entry(index)
+        del raw_entries[index]
+        print(f"Removed entry {index + 1} {removed.name} from {data.name}")
+
+    if isinstance(source, Store):
+        source.save_collection(collection_id, raw, data, args.filter)
+    else:
+        save_document(source.path, source.data)
+
+
+def list_years(args, source):
+    collections = source.years() if isinstance(source, Store) else raw_collections(source.data)
+    Table(
         args,
-        data.collections,
+        (SimpleNamespace(year=c.get('year'), name=c.get('name')) for c in collections),
         {
             'year': 'Year',
             'name': 'Name',
         }
-    ))
+    ).show()
+
+
+def list_batch(args):
+    paths = expand_paths(args.batch)
+    if not paths:
+        raise RuntimeError("No files found for batch")
+
+    def _items():
+        for result in run_batch(paths, args.year, args.filter, use_cache=not args.no_cache, jobs=args.jobs):
+            if result['error']:
+                yield SimpleNamespace(file=result['path'], error=result['error'])
+            for t, balances in result['closing'].items():
+                props = {'file': result['path'], 'name': result['name'], 'type': t}
+                props.update(zip(STATES, balances))
+                yield SimpleNamespace(**props)
+
+    columns = {
+        'file': 'File',
+        'name': 'Name',
+        'type': 'Type',
+    }
+    for k in STATES:
+        columns[k] = {
+            'label': k.title(),
+            'formatter_nonempty': lambda v: '{:1.2f}'.format(v / 8),
+        }
+    columns['error'] = 'Error'
+
+    Table(args, _items(), columns).show()
+
+
+def export_batch(args):
+    paths = expand_paths(args.batch)
+    if not paths:
+        raise RuntimeError("No files found for batch")
+
+    def _rows():
+        # One file at a time, so only one year's ledger is in memory
+        for path in paths:
+            try:
+                data = loader.load_year(SourceFile(path), args.year, args.filter, use_cache=not args.no_cache)
+            except Exception as e:
+                print(f"Skipping {path}: {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            yield from ledger_rows(data, path)
+
+    export(_rows(), args.export, args.export_format)
+
+
+def export_year(args, data):
+    export(ledger_rows(data), args.export, args.export_format)
+
+
+def list_balance_on(args, data):
+    date = arrow.get(args.balance_on, tzinfo=data.tzinfo)
+    columns = {'type': 'Type'}
+    for k in STATES:
+        columns[k] = {
+            'label': k.title(),
+            'formatter_nonempty': lambda v: '{:1.2f}'.format(v / 8),
+        }
+    Table(
+        args,
+        (
+            SimpleNamespace(type=t.short_name, **{k: data.balance_on(date, key, k) for k in STATES})
+            for key, t in data.pto_types.items()
+        ),
+        columns,
+    ).show()
+
+
+def list_plan(args, data):
+    after = arrow.get(args.plan_from, tzinfo=data.tzinfo) if args.plan_from else None
+    if args.plan not in data.pto_types:
+        raise RuntimeError(f"No PTO type {args.plan} in {data.name} (found {', '.join(data.pto_types)})")
+    Table(
+        args,
+        best_placements(data, args.plan, args.plan_days, after=after),
+        {
+            'start': {
+                'label': 'Start',
+                'formatter_nonempty': lambda v: v.format('ddd, MMM Do'),
+            },
+            'end': {
+                'label': 'End',
+                'formatter_nonempty': lambda v: v.format('ddd, MMM Do'),
+            },
+            'length': 'Days Off',
+            'days': 'PTO Days',
+        }
+    ).show()
+
+
+def list_simulation(args, data):
+    scenarios = raw_scenarios(SourceFile(args.simulate).data)
+
+    def _items():
+        for result in Simulation(data).run(scenarios):
+            yield SimpleNamespace(**result)
+
+    Table(
+        args,
+        _items(),
+        {
+            'name': 'Scenario',
+            'negative': {
+                'label': 'Negative On',
+                'formatter_nonempty': lambda v: v.format('ddd, MMM Do'),
+            },
+            'negative_type': 'Type',
+            'negative_state': 'State',
+            'minimum': {
+                'label': 'Minimum',
+                'formatter_nonempty': lambda v: '{:1.2f}'.format(v / 8),
+            },
+            'minimum_type': {
+                'label': 'Minimum Type',
+                'verbosity': 1,
+            },
+            'minimum_state': {
+                'label': 'Minimum State',
+                'verbosity': 1,
+            },
+            'error': 'Error',
+        }
+    ).show()
 
 
 def list_pto(args, data):
     def _slug(v):
         return re.sub(r'[^A-Za-z0-9]+', '_', v)
 
-    items = []
-    running_balance = {
-        _slug(t.short_name): {
-            'planned': 0,
-            'tentative': 0,
-            'requested': 0,
-            'approved': 0,
-        }
-        for t in data.pto_types.values()
-    }
-    for row in sorted(data.adjustments, key=lambda i: i.date):
-        type_ = _slug(row.pto_type.short_name)
-        props = {'state': None}
-        if row.pto:
-            if row.pto.approved is not None:
-                props['state'] = 'Denied'
-                if row.pto.approved:
-                    props['state'] = 'Approved'
-                    running_balance[type_]['planned'] += row.hours
-                    running_balance[type_]['approved'] += row.hours
-                    running_balance[type_]['requested'] += row.hours
-                    running_balance[type_]['tentative'] += row.hours
-            elif row.pto.requested:
-                props['state'] = 'Requested'
-                running_balance[type_]['planned'] += row.hours
-                running_balance[type_]['tentative'] += row.hours
-                running_balance[type_]['requested'] += row.hours
-            elif row.pto.tentative:
-                props['state'] = 'Tentative'
-                running_balance[type_]['tentative'] += row.hours
-            else:
-                props['state'] = 'Planned'
-                running_balance[type_]['tentative'] += row.hours
-                running_balance[type_]['planned'] += row.hours
-        else:
-            running_balance[type_]['planned'] += row.hours
-            running_balance[type_]['approved'] += row.hours
-            running_balance[type_]['requested'] += row.hours
-            running_balance[type_]['tentative'] += row.hours
-
-        props.update({
-            'name': row.pto.name if row.pto else None,
-            'start': row.pto.start if row.pto else row.date,
-            'end': row.pto.end if row.pto else None,
-            'type': row.pto_type.short_name,
-            'days': None,
-            'travel': None,
-            'lodging': None,
-            'registration': None,
-            'roommates': None,
-        })
-        for t, b in running_balance.items():
-            for k, v in b.items():
-                props[f'{t}_{k}'] = v
-        if row.pto:
-            props['days'] = row.pto.days
-            for k in ('travel', 'lodging', 'registration', 'roommates'):
-                v = getattr(row.pto, k, None)
-                if v is None:
-                    props[k] = 'N/A'
-                else:
-                    props[k] = 'Yes' if v else 'No'
-
-        items.append(SimpleNamespace(**props))
+    slugs = [_slug(t.short_name) for t in data.pto_types.values()]
+    ledger = data.ledger
+
+    def _items():
+        balances = ledger.balances
+        for row in range(len(ledger)):
+            pto = ledger.entry(row)
+            pto_type = ledger.pto_type(row)
+            props = {'state': ledger.state(row)}
+
+            props.update({
+                'id': ledger.entry_index[row] + 1 if pto else None,
+                'name': pto.name if pto else None,
+                'start': pto.start if pto else ledger.date(row),
+                'end': pto.end if pto else None,
+                'type': pto_type.short_name,
+                'days': None,
+                'travel': None,
+                'lodging': None,
+                'registration': None,
+                'roommates': None,
+            })
+            for ti, t in enumerate(slugs):
+                for si, k in enumerate(STATES):
+                    props[f'{t}_{k}'] = balances.at(row, ti, si)
+            if pto:
+                props['days'] = pto.days
+                for k in ('travel', 'lodging', 'registration', 'roommates'):
+                    v = getattr(pto, k, None)
+                    if v is None:
+                        props[k] = 'N/A'
+                    else:
+                        props[k] = 'Yes' if v else 'No'
+
+            yield SimpleNamespace(**props)
 
     columns = {
+        'id': {
+            'label': 'ID',
+            'verbosity': 1,
+        },
         'name': 'Name',
         'start': {
             'label': 'Start',
@@ -519,8 +692,8 @@ def list_pto(args, data):
         },
         'type': 'Type',
     }
-    for t, b in running_balance.items():
-        for k in b.keys():
+    for t in dict.fromkeys(slugs):
+        for k in STATES:
             vr = 0
             if k == 'approved':
                 vr = 1
@@ -542,31 +715,96 @@ def list_pto(args, data):
         'roommates': 'Roommates',
     })
 
-    print(Table(
+    Table(
         args,
-        items,
+        _items(),
         columns,
-    ))
+    ).show()
 
 
 def parse_args():
     year = arrow.now().year
     parser = argparse.ArgumentParser(description="Manage PTO")
-    parser.add_argument('-f', '--file', help="Path to file")
+    parser.add_argument('-f', '--file', help="Path to file, a .db, .sqlite or .sqlite3 file is used as an SQLite store")
     parser.add_argument('-y', '--year', type=int, default=year, help="Year to work with")
     parser.add_argument('-F', '--filter', help="Additional filter on name to disambiguate years if necessary")
     parser.add_argument('-l', '--list-years', action='store_true', help="List all years")
+    parser.add_argument('--no-cache', action='store_true', help="Don't read or write the cache of validated years")
+    parser.add_argument('-s', '--stream', action='store_true', help="Print rows as they are computed, with column widths fixed from the first rows")
+    parser.add_argument('-p', '--page', type=int, help="When streaming, repeat headers every this many rows")
+    parser.add_argument('--profile', nargs='?', const='text', choices=('text', 'json'), help="Print stage timings and counters to stderr, as text (default) or json")
+    parser.add_argument('-b', '--batch', nargs='+', metavar='PATH', help="Report closing balances for many files, directories or globs at once")
+    parser.add_argument('-j', '--jobs', type=int, help="Number of processes to use for --batch, defaults to the number of CPUs")
+    parser.add_argument('--serve', nargs='?', type=int, const=8642, metavar='PORT', help="Keep the file(s) loaded and answer queries over HTTP on localhost, on port 8642 by default")
+    parser.add_argument('-B', '--balance-on', metavar='DATE', help="Show balances of every type at the end of this date")
+    parser.add_argument('-a', '--add-entry', nargs='+', metavar='FIELD=VALUE', help="Add an entry to the year, e.g. name=Trip pto_type=vac start=2024-03-04 end=2024-03-08")
+    parser.add_argument('-e', '--edit-entry', nargs='+', metavar='ID FIELD=VALUE', help="Change fields of an entry by ID (shown with -v); an empty VALUE removes the field")
+    parser.add_argument('-r', '--remove-entry', metavar='ID', help="Remove an entry by ID (shown with -v)")
+    parser.add_argument('-i', '--import-entries', metavar='PATH', help="Add all entries of a YAML or JSON file, either a list or a document with pto_entries")
+    parser.add_argument('-P', '--plan', metavar='TYPE', help="Suggest where to take days of a PTO type for the longest stretches off")
+    parser.add_argument('--plan-days', type=float, metavar='DAYS', help="With --plan, number of days to take, defaults to all of the available balance")
+    parser.add_argument('--plan-from', metavar='DATE', help="With --plan, only suggest stretches starting on or after this date")
+    parser.add_argument('-S', '--simulate', metavar='PATH', help="Check plans of a YAML or JSON file against the balances, a list of scenarios each a list of entries or a document with name and pto_entries")
+    parser.add_argument('--import-document', metavar='PATH', help="Replace the contents of the SQLite store given with -f by a YAML or JSON file")
+    parser.add_argument('--export-document', metavar='PATH', help="Write the SQLite store given with -f to a YAML or JSON file")
+    parser.add_argument('-x', '--export', metavar='PATH', help="Write the ledger with running balances to a CSV, JSON Lines or Parquet file, - for CSV on stdout; with --batch, of every file")
+    parser.add_argument('--export-format', choices=FORMATS, help="Format for --export, by default from the file extension, or csv for stdout")
     parser.add_argument('-v', '--verbose', action='count', default=0, help="Verbosity level, specify multiple times")
     return parser.parse_args()
 
 
 def main(args):
-    data = load_file(args)
+    if args.profile:
+        profiling.enable()
+    with profiling.span('total'):
+        run(args)
+    if args.profile:
+        print(profiling.format_report(args.profile), file=sys.stderr)
+
+
+def run(args):
+    if args.serve:
+        paths = expand_paths(args.batch) if args.batch else [find_file(args.file)]
+        print(f"Serving {', '.join(paths)} on http://127.0.0.1:{args.serve}/", file=sys.stderr)
+        serve(PTOService(paths, args.filter), port=args.serve, verbose=bool(args.verbose))
+        return
+
+    if args.batch:
+        if args.export:
+            export_batch(args)
+        else:
+            list_batch(args)
+        return
+
+    if args.import_document or args.export_document:
+        transfer_document(args)
+        return
+
+    source = load_file(args)
+    if isinstance(source, Store):
+        with source:
+            run_source(args, source)
+    else:
+        run_source(args, source)
+
+
+def run_source(args, source):
     if args.list_years:
-        list_years(args, data)
+        list_years(args, source)
     else:
-        year_data = load_year(args, data)
-        list_pto(args, year_data)
+        year_data = load_year(args, source)
+        if args.add_entry or args.edit_entry or args.remove_entry or args.import_entries:
+            edit_entries(args, source, year_data)
+        if args.export:
+            export_year(args, year_data)
+        elif args.simulate:
+            list_simulation(args, year_data)
+        elif args.plan:
+            list_plan(args, year_data)
+        elif args.balance_on:
+            list_balance_on(args, year_data)
+        else:
+            list_pto(args, year_data)
         # for a in f.collections[0].adjustments:
         #     print(a.date, a.hours)
 